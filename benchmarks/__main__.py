@@ -0,0 +1,113 @@
+"""
+Offline benchmark suite: synthetic glyph datasets, per-stage timing
+and peak memory, and comparison of results against a saved baseline.
+
+Usage: python -m benchmarks --help
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import json
+import platform
+import sys
+
+import click
+
+from benchmarks.glyphs import generate_glyphs
+from benchmarks.stages import run_stages
+
+
+@click.group(name='benchmarks')
+def main():
+    pass
+
+
+@main.command(name="generate")
+@click.argument("output_dir", type=Path, required=True)
+@click.option("-n", "--n-images", type=int, default=1000)
+@click.option("--height", type=(int, int), default=(24, 40))
+@click.option("--width", type=(int, int), default=(16, 32))
+@click.option("--seed", type=int, default=0)
+def generate(output_dir, n_images, height, width, seed):
+    """
+    Generates synthetic glyph images with metadata file (meta.txt).
+    """
+    meta_path = generate_glyphs(output_dir, n_images, height, width, seed=seed)
+    click.echo(f"Metadata saved to {meta_path}")
+
+
+@main.command(name="run")
+@click.option("-o", "--output-file", type=Path, required=True)
+@click.option(
+    "--meta", "meta_path", type=Path, default=None,
+    help="Existing metadata file, unless provided a synthetic dataset "
+    "is generated.")
+@click.option("-n", "--n-images", type=int, default=1000)
+@click.option("--height", type=(int, int), default=(24, 40))
+@click.option("--width", type=(int, int), default=(16, 32))
+@click.option("--seed", type=int, default=0)
+@click.option("-j", "--jobs", type=int, default=1)
+def run(output_file, meta_path, n_images, height, width, seed, jobs):
+    """
+    Measures every stage of the default pipeline, saves results as json.
+    """
+    config = {
+        'n_images': n_images,
+        'height': height,
+        'width': width,
+        'seed': seed,
+        'jobs': jobs,
+        'meta': str(meta_path) if meta_path else None,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+    }
+    with TemporaryDirectory() as data_dir:
+        if meta_path is None:
+            meta_path = generate_glyphs(
+                data_dir, n_images, height, width, seed=seed
+            )
+        stages = run_stages(meta_path, n_jobs=jobs)
+    with open(output_file, 'w') as f:
+        json.dump({'config': config, 'stages': stages}, f, indent=2)
+    for name, result in stages.items():
+        click.echo(
+            f"{name:24s} {result['wall_time']:8.3f}s "
+            f"{result['peak_memory_mb']:8.1f}MB"
+        )
+
+
+@main.command(name="compare")
+@click.argument("baseline_file", type=Path, required=True)
+@click.argument("result_file", type=Path, required=True)
+@click.option(
+    "--tolerance", type=float, default=0.2,
+    help="Relative increase of time or memory reported as regression.")
+def compare(baseline_file, result_file, tolerance):
+    """
+    Compares results with a baseline, exits with status 1 on regressions.
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)['stages']
+    with open(result_file) as f:
+        result = json.load(f)['stages']
+    regressions = 0
+    for name in result:
+        if name not in baseline:
+            continue
+        for metric in ('wall_time', 'peak_memory_mb'):
+            old, new = baseline[name][metric], result[name][metric]
+            change = (new - old) / old if old > 0 else 0.
+            flag = ""
+            if change > tolerance:
+                flag = "  REGRESSION"
+                regressions += 1
+            click.echo(
+                f"{name:24s} {metric:15s} {old:10.3f} -> {new:10.3f} "
+                f"({change:+.0%}){flag}"
+            )
+    if regressions:
+        click.echo(f"{regressions} regression(s) found")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares uint8 binary masks with bit-packed masks (MaskImageReader
+with packed=True): memory of decoded images, vectorization time
+of filter and IOU vectorizers, and the largest difference of features.
+
+Usage: python -m benchmarks.bitmask [N_IMAGES]
+"""
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+import numpy as np
+
+from benchmarks.glyphs import generate_glyphs
+from image_cluster.pipeline import (
+    FilterImageVectorizer,
+    IOUImageVectorizer,
+    MaskImageReader,
+    MetadataReader,
+)
+
+
+VECTORIZERS = [
+    ('filter 3x3', lambda: FilterImageVectorizer((3, 3))),
+    ('iou 3x3', lambda: IOUImageVectorizer((3, 3))),
+    ('iou 4x4 (1024)', lambda: IOUImageVectorizer((4, 4), max_filters=1024)),
+]
+
+
+def main(n_images: int = 2000):
+    with TemporaryDirectory() as data_dir:
+        meta_path = generate_glyphs(data_dir, n_images)
+        image_data = MetadataReader().transform(meta_path)
+        masks = MaskImageReader().transform(image_data)
+        masks = [img.image for img in masks]
+        packed = MaskImageReader(packed=True).transform(image_data)
+        packed = [img.image for img in packed]
+    mask_mb = sum(mask.nbytes for mask in masks) / 2**20
+    packed_mb = sum(mask.bits.nbytes for mask in packed) / 2**20
+    print(f"images: {n_images}, "
+          f"uint8 masks: {mask_mb:.2f}MB, packed: {packed_mb:.2f}MB")
+    print("vectorizer        uint8[s]  packed[s]  max difference")
+    for name, make_vectorizer in VECTORIZERS:
+        times = []
+        vectors = []
+        for images in (masks, packed):
+            for img, image in zip(image_data, images):
+                img.image = image
+            start = perf_counter()
+            vectors.append(make_vectorizer().transform(image_data))
+            times.append(perf_counter() - start)
+        difference = np.max(np.abs(vectors[0] - vectors[1]))
+        print(f"{name:16s}  {times[0]:8.2f}  {times[1]:9.2f}"
+              f"  {difference:.2e}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
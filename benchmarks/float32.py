@@ -0,0 +1,80 @@
+"""
+Compares float64 features with float32 features and dimensionality
+reduction: memory of the feature matrix, clustering and scoring time,
+and agreement of labels with the float64 pipeline (adjusted Rand index).
+
+Usage: python -m benchmarks.float32 [N_IMAGES]
+"""
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+from sklearn.cluster import AgglomerativeClustering
+from sklearn.decomposition import IncrementalPCA
+from sklearn.metrics import adjusted_rand_score
+from sklearn.random_projection import SparseRandomProjection
+import numpy as np
+
+from benchmarks.glyphs import generate_glyphs
+from image_cluster.pipeline import (
+    default_transformers,
+    optimal_clusters,
+    ModelFactory,
+    Pipeline,
+)
+
+
+VARIANTS = [
+    ('float64', np.float64, None),
+    ('float32', np.float32, None),
+    ('float32+pca', np.float32, IncrementalPCA(n_components=64)),
+    ('float32+projection', np.float32, SparseRandomProjection(
+        n_components=64,
+        dense_output=True,
+        random_state=0
+    )),
+]
+
+
+def main(n_images: int = 1500):
+    with TemporaryDirectory() as data_dir:
+        meta_path = generate_glyphs(data_dir, n_images)
+        print("variant             features[MB]  model[s]  score[s]  ARI")
+        reference = None
+        for name, dtype, reducer in VARIANTS:
+            preprocessing, _ = default_transformers(
+                None,
+                verbose=False,
+                dtype=dtype,
+                reducer=reducer
+            )
+            pipeline = Pipeline(
+                preprocessing,
+                ModelFactory(
+                    optimal_clusters,
+                    AgglomerativeClustering,
+                    linkage='ward'
+                ),
+                postprocessing=None
+            )
+            pipeline.preprocessed_ = preprocessing.fit_transform(meta_path)
+            pipeline.model_ = pipeline.model_factory(n_images)
+            start = perf_counter()
+            pipeline.labels_ = pipeline.model_.fit_predict(
+                pipeline.preprocessed_
+            )
+            model_time = perf_counter() - start
+            start = perf_counter()
+            pipeline.score()
+            score_time = perf_counter() - start
+            if reference is None:
+                reference = pipeline.labels_
+            print(
+                f"{name:18s}  {pipeline.preprocessed_.nbytes / 2**20:12.2f}"
+                f"  {model_time:8.2f}  {score_time:8.2f}"
+                f"  {adjusted_rand_score(reference, pipeline.labels_):.3f}"
+            )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""
+Reproducible synthetic dataset of black-and-white glyph images.
+"""
+from pathlib import Path
+from typing import Tuple
+
+import cv2 as cv
+import numpy as np
+
+
+FONTS = [
+    cv.FONT_HERSHEY_SIMPLEX,
+    cv.FONT_HERSHEY_DUPLEX,
+    cv.FONT_HERSHEY_COMPLEX,
+    cv.FONT_HERSHEY_TRIPLEX,
+    cv.FONT_HERSHEY_SCRIPT_SIMPLEX,
+]
+CHARACTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def render_glyph(
+        character: str,
+        font: int,
+        shape: Tuple[int, int],
+        rng: np.random.RandomState
+) -> np.array:
+    """
+    Renders black character on white background, scaled to fit the image,
+    with random thickness and position jitter.
+    """
+    height, width = shape
+    thickness = rng.randint(1, 3)
+    (text_width, text_height), baseline = cv.getTextSize(
+        character, font, 1., thickness
+    )
+    scale = 0.8 * min(
+        width / max(text_width, 1),
+        height / max(text_height + baseline, 1)
+    )
+    x = int((width - scale * text_width) / 2) + rng.randint(-1, 2)
+    y = int((height + scale * (text_height - baseline)) / 2) \
+        + rng.randint(-1, 2)
+    img = np.full(shape, 255, dtype=np.uint8)
+    cv.putText(img, character, (x, y), font, scale, 0, thickness)
+    return img
+
+
+def generate_glyphs(
+        output_dir: Path,
+        n_images: int,
+        height: Tuple[int, int] = (24, 40),
+        width: Tuple[int, int] = (16, 32),
+        n_characters: int = 40,
+        seed: int = 0
+) -> Path:
+    """
+    Saves n_images glyph PNGs of random sizes (inclusive ranges)
+    and returns path of metadata file listing them.
+    """
+    output_dir = Path(output_dir).resolve()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    meta = []
+    for idx in range(n_images):
+        character = CHARACTERS[rng.randint(min(n_characters, len(CHARACTERS)))]
+        font = FONTS[rng.randint(len(FONTS))]
+        shape = (
+            rng.randint(height[0], height[1] + 1),
+            rng.randint(width[0], width[1] + 1)
+        )
+        img_path = output_dir / f"{idx:07d}.png"
+        cv.imwrite(str(img_path), render_glyph(character, font, shape, rng))
+        meta.append(f"{img_path}\n")
+    meta_path = output_dir / "meta.txt"
+    with open(meta_path, 'w') as f:
+        f.writelines(meta)
+    return meta_path
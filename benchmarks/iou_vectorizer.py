@@ -0,0 +1,69 @@
+"""
+Compares the batched IOUImageVectorizer engine
+with the original per-window Python loop.
+
+Usage: python -m benchmarks.iou_vectorizer [N_IMAGES] [HEIGHT] [WIDTH]
+"""
+from itertools import product
+from time import perf_counter
+import sys
+
+import numpy as np
+
+from image_cluster.pipeline import IOUImageVectorizer
+from image_cluster.types import ImageData
+
+
+def loop_vectorize(vectorizer: IOUImageVectorizer, image_data: ImageData):
+    """
+    Reference implementation: one Python iteration per image window.
+    """
+    img = image_data.image
+    filter_shape = vectorizer.filter_shape
+    vector = np.zeros(vectorizer.n_filters, dtype=np.float64)
+    xrange = np.arange(img.shape[0] - filter_shape[0] + 1)
+    yrange = np.arange(img.shape[1] - filter_shape[1] + 1)
+    for x, y in product(xrange, yrange):
+        img_chunk = img[x:x+filter_shape[0], y:y+filter_shape[1]]
+        intersections = np.sum(vectorizer.filters * img_chunk, axis=(1, 2))
+        unions = np.sum(vectorizer.filters + img_chunk, axis=(1, 2))
+        intersections[unions == 0] = 1
+        unions[unions == 0] = 1
+        vector += intersections / unions
+    return vector
+
+
+def random_images(n_images: int, height: int, width: int, seed: int = 0):
+    """
+    Greyscale images with mostly white background, like scanned glyphs.
+    """
+    rng = np.random.RandomState(seed)
+    images = []
+    for idx in range(n_images):
+        img = rng.rand(height, width)
+        img[img < 0.7] = 0.
+        images.append(ImageData(f"{idx}.png", None, img))
+    return images
+
+
+def main(n_images: int = 20, height: int = 32, width: int = 32):
+    vectorizer = IOUImageVectorizer(filter_shape=(3, 3))
+    images = random_images(n_images, height, width)
+
+    start = perf_counter()
+    expected = np.array([loop_vectorize(vectorizer, img) for img in images])
+    loop_time = perf_counter() - start
+
+    start = perf_counter()
+    actual = vectorizer.transform(images)
+    batch_time = perf_counter() - start
+
+    assert np.allclose(actual, expected), "batched output differs from loop"
+    print(f"images: {n_images} ({height}x{width})")
+    print(f"loop:    {loop_time:.3f}s")
+    print(f"batched: {batch_time:.3f}s")
+    print(f"speedup: {loop_time / batch_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,112 @@
+"""
+Load test of the serve command: fits a model on synthetic glyphs,
+starts the server on a Unix socket, and sends requests of BATCH_SIZE
+random images from N_CLIENTS concurrent clients, reporting client-side
+throughput and latency along with server counters. Runs offline.
+
+Usage: python -m benchmarks.serve [N_IMAGES] [N_CLIENTS] [N_REQUESTS]
+       [BATCH_SIZE]
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter, sleep
+import random
+import subprocess
+import sys
+
+import numpy as np
+
+from benchmarks.glyphs import generate_glyphs
+from image_cluster.client import Client
+
+
+CLI = [sys.executable, '-m', 'image_cluster']
+
+
+def wait_for_server(socket_path: Path, timeout: float = 60.):
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        if socket_path.exists():
+            try:
+                return Client(socket_path=str(socket_path)).stats()
+            except OSError:
+                pass
+        sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def run_client(
+        socket_path: Path,
+        paths: list,
+        n_requests: int,
+        batch_size: int,
+        seed: int,
+        latencies: list
+):
+    rng = random.Random(seed)
+    client = Client(socket_path=str(socket_path))
+    for _ in range(n_requests):
+        batch = rng.sample(paths, batch_size)
+        start = perf_counter()
+        client.assign(batch)
+        latencies.append(perf_counter() - start)
+    client.close()
+
+
+def main(
+        n_images: int = 1000,
+        n_clients: int = 8,
+        n_requests: int = 50,
+        batch_size: int = 4
+):
+    with TemporaryDirectory() as data_dir:
+        data_dir = Path(data_dir)
+        meta_path = generate_glyphs(data_dir / 'images', n_images)
+        subprocess.run(CLI + [
+            'cluster', str(meta_path),
+            '-o', str(data_dir / 'model'),
+            '--silent', '--no-score', '--no-html'
+        ], check=True)
+        with open(meta_path) as f:
+            paths = [line.strip() for line in f]
+        socket_path = data_dir / 'serve.sock'
+        server = subprocess.Popen(CLI + [
+            'serve', str(data_dir / 'model'),
+            '--socket', str(socket_path)
+        ], stdout=subprocess.DEVNULL)
+        try:
+            wait_for_server(socket_path)
+            latencies = []
+            clients = [
+                Thread(target=run_client, args=(
+                    socket_path, paths, n_requests, batch_size,
+                    seed, latencies
+                ))
+                for seed in range(n_clients)
+            ]
+            start = perf_counter()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = perf_counter() - start
+            stats = Client(socket_path=str(socket_path)).stats()
+        finally:
+            server.terminate()
+            server.wait()
+    latencies = np.array(latencies) * 1000
+    n_assigned = len(latencies) * batch_size
+    print(f"{n_clients} clients, {len(latencies)} requests "
+          f"of {batch_size} images in {elapsed:.2f}s")
+    print(f"throughput: {n_assigned / elapsed:.1f} images/s")
+    print(f"latency: p50 {np.percentile(latencies, 50):.1f}ms, "
+          f"p95 {np.percentile(latencies, 95):.1f}ms, "
+          f"max {np.max(latencies):.1f}ms")
+    print(f"server: {stats['batches']} batches "
+          f"(mean {stats['mean_batch_size']:.1f} images), "
+          f"{stats['errors']} errors")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
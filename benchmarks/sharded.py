@@ -0,0 +1,77 @@
+"""
+Checks sharded vectorization locally: images are vectorized
+by N_SHARDS processes started at once (standing in for nodes) with the
+vectorize command, merged with the cluster-features command, and the
+results are compared with a single-node cluster run (must be identical).
+
+Usage: python -m benchmarks.sharded [N_IMAGES] [N_SHARDS]
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import filecmp
+import subprocess
+import sys
+
+from benchmarks.glyphs import generate_glyphs
+
+
+CLI = [sys.executable, '-m', 'image_cluster']
+
+
+def run_sharded(meta_path: Path, work_dir: Path, n_shards: int) -> float:
+    start = perf_counter()
+    shard_files = [work_dir / f"features-{i}.npz" for i in range(n_shards)]
+    nodes = [
+        subprocess.Popen(CLI + [
+            'vectorize', str(meta_path),
+            '-o', str(shard_file),
+            '--part', f"{i}/{n_shards}",
+            '--silent'
+        ])
+        for i, shard_file in enumerate(shard_files)
+    ]
+    for node in nodes:
+        if node.wait() != 0:
+            raise RuntimeError("vectorize command failed")
+    subprocess.run(CLI + [
+        'cluster-features', *map(str, shard_files),
+        '-o', str(work_dir / 'sharded'),
+        '--silent', '--no-score'
+    ], check=True)
+    return perf_counter() - start
+
+
+def run_single(meta_path: Path, work_dir: Path) -> float:
+    start = perf_counter()
+    subprocess.run(CLI + [
+        'cluster', str(meta_path),
+        '-o', str(work_dir / 'single'),
+        '--silent', '--no-score'
+    ], check=True)
+    return perf_counter() - start
+
+
+def main(n_images: int = 2000, n_shards: int = 4):
+    with TemporaryDirectory() as data_dir:
+        data_dir = Path(data_dir)
+        meta_path = generate_glyphs(data_dir / 'images', n_images)
+        single_time = run_single(meta_path, data_dir)
+        sharded_time = run_sharded(meta_path, data_dir, n_shards)
+        identical = all(
+            filecmp.cmp(
+                data_dir / 'single' / name,
+                data_dir / 'sharded' / name,
+                shallow=False
+            )
+            for name in ('clusters.txt', 'clusters.html')
+        )
+    print(f"single node: {single_time:.2f}s")
+    print(f"{n_shards} shards:    {sharded_time:.2f}s")
+    print(f"identical output: {identical}")
+    if not identical:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,123 @@
+"""
+Per-stage timing and peak memory of the default clustering pipeline.
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, process_time
+from typing import Callable, Dict
+import tracemalloc
+
+from sklearn.cluster import AgglomerativeClustering
+import numpy as np
+
+from image_cluster.pipeline import (
+    default_transformers,
+    optimal_clusters,
+    MaskImageReader,
+    ModelFactory,
+    Pipeline,
+    Writer,
+)
+
+
+def measure(stage: Callable[[], object]) -> Dict[str, float]:
+    """
+    Runs stage twice: once for timing and once with tracemalloc
+    for peak memory (tracing would distort timings).
+    """
+    start_time, start_cpu = perf_counter(), process_time()
+    stage()
+    wall_time = perf_counter() - start_time
+    cpu_time = process_time() - start_cpu
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'peak_memory_mb': peak / 2**20
+    }
+
+
+def run_stages(meta_path: Path, n_jobs: int = None) -> Dict[str, Dict]:
+    """
+    Times every stage of the default pipeline separately,
+    each stage consumes output of the previous one.
+    """
+    with TemporaryDirectory() as output_dir:
+        preprocessing, postprocessing = default_transformers(
+            Writer(Path(output_dir), html=True),
+            verbose=False,
+            n_jobs=n_jobs
+        )
+        steps = preprocessing.named_steps
+        model_factory = ModelFactory(
+            optimal_clusters,
+            AgglomerativeClustering,
+            affinity='euclidean',
+            linkage='ward'
+        )
+        pipeline = Pipeline(preprocessing, model_factory, postprocessing)
+        state = {}
+
+        def read_meta():
+            state['meta'] = steps['meta'].transform(meta_path)
+
+        def read_masks():
+            MaskImageReader().transform(state['meta'])
+
+        def read_greyscale():
+            state['images'] = steps['image'].transform(state['meta'])
+
+        # vectorizers of FeatureUnion are measured separately
+        vectorizers = getattr(
+            steps['vectorizer'],
+            'transformer_list',
+            [('vectorizer', steps['vectorizer'])]
+        )
+
+        def vectorize(name, vectorizer):
+            state[f'vectors.{name}'] = vectorizer.transform(state['images'])
+
+        def scale():
+            pipeline.preprocessed_ = steps['scaler'].fit_transform(np.hstack([
+                state[f'vectors.{name}'] for name, _ in vectorizers
+            ]))
+
+        def fit_model():
+            pipeline.model_ = model_factory(len(pipeline.preprocessed_))
+            pipeline.labels_ = pipeline.model_.fit_predict(
+                pipeline.preprocessed_
+            )
+
+        def score():
+            pipeline.score()
+
+        def write():
+            postprocessing.fit_transform(pipeline.labels_)
+
+        stages = [
+            ('meta', read_meta),
+            ('mask_reader', read_masks),
+            ('greyscale_reader', read_greyscale),
+        ] + [
+            (
+                f'vectorizer.{name}',
+                lambda name=name, vectorizer=vectorizer:
+                    vectorize(name, vectorizer)
+            )
+            for name, vectorizer in vectorizers
+        ] + [
+            ('scaler', scale),
+            ('model', fit_model),
+            ('score', score),
+            ('writer', write),
+        ]
+        results = {}
+        for name, stage in stages:
+            results[name] = measure(stage)
+            results[name]['items_per_second'] = (
+                len(state['meta']) / max(results[name]['wall_time'], 1e-9)
+            )
+        return results
@@ -0,0 +1,113 @@
+"""
+Checks the import budget of short CLI invocations (--help and meta):
+heavy dependencies must not be imported, and importing the CLI
+must take less than IMPORT_BUDGET_MS (measured with python -X importtime).
+The assign command (run for every batch of new images) must import
+only the modules it uses. Also checks that shard modes of the CLI
+match ImagePacker.modes.
+
+Usage: python -m benchmarks.startup [N_IMAGES]
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import subprocess
+import sys
+
+from benchmarks.glyphs import generate_glyphs
+
+
+IMPORT_BUDGET_MS = 150
+FORBIDDEN_MODULES = ('numpy', 'scipy', 'sklearn', 'cv2', 'matplotlib')
+# modules used only for fitting, searching or plotting
+ASSIGN_FORBIDDEN_MODULES = (
+    'matplotlib',
+    'image_cluster.pipeline.pipeline',
+    'image_cluster.pipeline.model',
+    'image_cluster.pipeline.metrics',
+    'image_cluster.pipeline.search',
+    'image_cluster.pipeline.sweep',
+    'image_cluster.pipeline.streaming',
+    'image_cluster.pipeline.sharding',
+)
+
+
+def imported_modules(args: list) -> dict:
+    """
+    Runs the CLI with given arguments, returns cumulative import time
+    (in microseconds) of every imported top-level module.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'image_cluster', *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def check(
+        name: str,
+        args: list,
+        forbidden_modules: tuple = FORBIDDEN_MODULES
+) -> bool:
+    modules = imported_modules(args)
+    forbidden = [
+        prefix for prefix in forbidden_modules
+        if any(
+            module == prefix or module.startswith(prefix + '.')
+            for module in modules
+        )
+    ]
+    import_ms = modules.get('image_cluster.cli', 0) / 1000
+    ok = not forbidden and import_ms < IMPORT_BUDGET_MS
+    print(f"{name:8s} cli import: {import_ms:6.1f}ms "
+          f"(budget {IMPORT_BUDGET_MS}ms), "
+          f"forbidden modules: {', '.join(forbidden) or 'none'}")
+    return ok
+
+
+def check_shard_modes() -> bool:
+    # the CLI keeps its own copy, importing the reader would import cv2
+    from image_cluster.cli import SHARD_MODES
+    from image_cluster.pipeline import ImagePacker
+    ok = tuple(SHARD_MODES) == tuple(ImagePacker.modes)
+    print(f"shard modes match ImagePacker.modes: {ok}")
+    return ok
+
+
+def main(n_images: int = 200):
+    with TemporaryDirectory() as data_dir:
+        data_dir = Path(data_dir)
+        meta_args = ['meta', str(data_dir), '-o', str(data_dir / 'meta.txt')]
+        results = [
+            check('--help', ['--help']),
+            check('meta', meta_args),
+        ]
+        meta_path = generate_glyphs(data_dir / 'images', n_images)
+        subprocess.run([
+            sys.executable, '-m', 'image_cluster',
+            'cluster', str(meta_path),
+            '-o', str(data_dir / 'model'),
+            '--silent', '--no-score', '--no-html'
+        ], check=True)
+        assign_args = [
+            'assign', str(meta_path),
+            '-o', str(data_dir / 'model'),
+            '--silent', '--no-html'
+        ]
+        results.append(check('assign', assign_args, ASSIGN_FORBIDDEN_MODULES))
+    results.append(check_shard_modes())
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,62 @@
+"""
+Compares exact ward clustering with TwoStageClustering:
+running time, peak memory and agreement of labels (adjusted Rand index),
+on synthetic datasets small enough for exact ward.
+
+Usage: python -m benchmarks.two_stage [N_SAMPLES ...]
+"""
+from time import perf_counter
+import sys
+import tracemalloc
+
+from sklearn.cluster import AgglomerativeClustering
+from sklearn.datasets import make_blobs
+from sklearn.metrics import adjusted_rand_score
+
+from image_cluster.pipeline import TwoStageClustering
+
+
+def measure(model, X):
+    tracemalloc.start()
+    start = perf_counter()
+    labels = model.fit_predict(X)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return labels, elapsed, peak / 2**20
+
+
+def main(*sizes: int):
+    sizes = sizes or (2000, 4000, 8000)
+    print("n_samples  model      time[s]  peak[MB]  ARI")
+    for n_samples in sizes:
+        X, _ = make_blobs(
+            n_samples,
+            n_features=64,
+            centers=80,
+            cluster_std=4.,
+            random_state=0
+        )
+        exact, exact_time, exact_memory = measure(
+            AgglomerativeClustering(n_clusters=80, linkage='ward'),
+            X
+        )
+        print(
+            f"{n_samples:9d}  ward       "
+            f"{exact_time:7.2f}  {exact_memory:8.1f}"
+        )
+        for n_micro_clusters in (500, 2000):
+            labels, elapsed, memory = measure(
+                TwoStageClustering(80, n_micro_clusters=n_micro_clusters),
+                X
+            )
+            print(
+                f"{n_samples:9d}  two-stage  "
+                f"{elapsed:7.2f}  {memory:8.1f}  "
+                f"{adjusted_rand_score(exact, labels):.3f}"
+                f"  ({n_micro_clusters} micro-clusters)"
+            )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
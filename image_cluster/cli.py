@@ -1,17 +1,18 @@
+from dataclasses import asdict
 from pathlib import Path
-import os
-import random
+import csv
 
 import click
-from sklearn.cluster import AgglomerativeClustering
 
-from image_cluster.pipeline import (
-    default_transformers,
-    optimal_clusters,
-    Writer,
-    ModelFactory,
-    Pipeline,
-)
+# heavy dependencies (numpy, scikit-learn, OpenCV) are imported
+# inside commands, so that short commands (and --help) start quickly
+
+
+MODEL_FILE = 'model.pkl'
+REDUCERS = ('none', 'pca', 'random-projection')
+# copy of ImagePacker.modes, importing the reader on startup would import
+# OpenCV (benchmarks.startup checks that they match)
+SHARD_MODES = ('greyscale', 'mask')
 
 
 @click.group(name='image_cluster')
@@ -30,64 +31,647 @@ def main():
 @click.option(
     "--html/--no-html", default=True,
     help="Whether to save output in html format or only in text format.")
+@click.option(
+    "--report/--no-report", default=False,
+    help="Save paginated html report with thumbnail sprite sheets "
+    "(in report subdirectory of the output directory).")
 @click.option("--verbose/--silent", default=True)
 @click.option(
     "--score/--no-score", default=True,
     help="Calculate metrics after fitting the model.")
-def cluster_images(input_file, output_dir, n_clusters, html, verbose, score):
+@click.option(
+    "--score-sample", type=int, default=None,
+    help="Estimate silhouette score from a sample of this size "
+    "(stratified over clusters). Unless provided, computed exactly.")
+@click.option(
+    "-j", "--jobs", type=int, default=1,
+    help="Number of processes used for vectorization (-1 = all CPUs).")
+@click.option(
+    "--read-threads", type=int, default=1,
+    help="Number of threads used for reading images (-1 = all CPUs).")
+@click.option(
+    "--cache-dir", type=Path, default=None,
+    help="Directory for caching image features between runs.")
+@click.option(
+    "--cache-size", type=int, default=1024,
+    help="Maximum size of the feature cache in megabytes.")
+@click.option(
+    "--low-memory/--keep-images", default=False,
+    help="Release image pixels once features are computed "
+    "(peak memory is lowered only by --streaming).")
+@click.option(
+    "--model", type=click.Choice(['ward', 'two-stage']), default='ward',
+    help="Exact ward clustering, or ward clustering of micro-cluster "
+    "centroids (for large datasets).")
+@click.option(
+    "--micro-clusters", type=int, default=2000,
+    help="Number of micro-clusters used by the two-stage model.")
+@click.option(
+    "--trace", type=Path, default=None,
+    help="Save Chrome trace (Perfetto) of pipeline stages to this file, "
+    "and their metrics next to it (with .metrics.json suffix).")
+@click.option(
+    "--float32/--float64", default=False,
+    help="Compute features in single precision (halves memory).")
+@click.option(
+    "--reduce", type=click.Choice(REDUCERS), default='none',
+    help="Dimensionality reduction applied after feature scaling.")
+@click.option(
+    "--n-components", type=int, default=64,
+    help="Number of dimensions after reduction.")
+@click.option(
+    "--filter-shape", type=(int, int), default=(3, 3),
+    help="Shape of image chunks compared with IOU filters.")
+@click.option(
+    "--max-filters", type=int, default=None,
+    help="Compute IOU features for this many randomly sampled filters, "
+    "if there are more possible filters (required for shapes above 4x4).")
+@click.option(
+    "--streaming/--staged", default=False,
+    help="Vectorize images while others are still being read, "
+    "releasing their pixels right after. "
+    "Can't be used with --cache-dir or --dedup.")
+@click.option(
+    "--dedup/--no-dedup", default=False,
+    help="Cluster only one image of every group of duplicates "
+    "(weighted by group size). Can't be used with --cache-dir.")
+@click.option(
+    "--dedup-threshold", type=int, default=None,
+    help="Also collapse near duplicates, with perceptual hashes "
+    "differing by at most this many bits (out of 64).")
+@click.option(
+    "--shard", type=Path, default=None,
+    help="Read images from a shard created by the pack command "
+    "instead of decoding image files.")
+def cluster_images(
+        input_file, output_dir, n_clusters, html, report, verbose, score,
+        score_sample, jobs, read_threads, cache_dir, cache_size, low_memory,
+        model, micro_clusters, trace, float32, reduce, n_components,
+        filter_shape, max_filters, streaming, dedup, dedup_threshold, shard
+):
     """
     Main command for clustering images.
     Input file should contain paths to images,
     as described in task specification.
+    Fitted model is saved in the output directory,
+    for use with the assign command.
     """
+    import numpy as np
+    from image_cluster.pipeline import (
+        default_transformers,
+        Pipeline,
+        Tracer,
+        Writer
+    )
+    if dedup and cache_dir is not None:
+        raise click.UsageError("--dedup can't be used with --cache-dir")
+    if streaming and (dedup or cache_dir is not None):
+        raise click.UsageError(
+            "--streaming can't be used with --cache-dir or --dedup"
+        )
     if output_dir is None:
         writer = None
     else:
-        writer = Writer(output_dir, html, verbose)
-    preprocessing, postprocessing = default_transformers(writer, verbose)
+        writer = Writer(output_dir, html, verbose, report=report, n_jobs=jobs)
+    try:
+        preprocessing, postprocessing = default_transformers(
+            writer,
+            verbose,
+            n_jobs=jobs,
+            read_threads=read_threads,
+            cache_dir=cache_dir,
+            max_cache_size=cache_size * 2**20,
+            low_memory=low_memory,
+            dtype=np.float32 if float32 else np.float64,
+            reducer=_reducer(reduce, n_components),
+            shard_dir=shard,
+            filter_shape=filter_shape,
+            max_filters=max_filters,
+            deduplicate=dedup,
+            hamming_threshold=dedup_threshold,
+            streaming=streaming
+        )
+    except ValueError as error:
+        # e.g. filter shape with too many filters and no --max-filters
+        raise click.UsageError(str(error))
+    model_factory = _model_factory(
+        model,
+        n_clusters,
+        micro_clusters,
+        # duplicates are represented by sample weights
+        weighted=dedup
+    )
+    tracer = None if trace is None else Tracer()
+    pipeline = Pipeline(
+        preprocessing,
+        model_factory,
+        postprocessing,
+        verbose,
+        tracer,
+        deduplicator=preprocessing.named_steps.get('dedup')
+    )
+    pipeline.fit_predict(input_file)
+    if output_dir is not None:
+        pipeline.save(output_dir / MODEL_FILE)
+    if score:
+        pipeline.score(score_sample)
+    if tracer is not None:
+        tracer.save(trace, trace.with_suffix('.metrics.json'))
+    return pipeline  # for use in python scripts
+
+
+def _model_factory(
+        model: str,
+        n_clusters: int,
+        micro_clusters: int,
+        weighted: bool = False
+):
+    from sklearn.cluster import AgglomerativeClustering
+    from image_cluster.pipeline import (
+        optimal_clusters,
+        ModelFactory,
+        TwoStageClustering,
+        WeightedWardClustering
+    )
+    if model == 'ward' and weighted:
+        model_class = WeightedWardClustering
+        model_kwargs = dict()
+    elif model == 'ward':
+        model_class = AgglomerativeClustering
+        model_kwargs = dict(affinity='euclidean', linkage='ward')
+    else:
+        model_class = TwoStageClustering
+        model_kwargs = dict(n_micro_clusters=micro_clusters)
     if n_clusters is None:
-        model_factory = ModelFactory(
+        return ModelFactory(
             optimal_clusters,
-            AgglomerativeClustering,
-            affinity='euclidean',
-            linkage='ward'
+            model_class,
+            **model_kwargs
         )
-    else:
-        model_factory = ModelFactory.fixed_clusters(
-            n_clusters,
-            AgglomerativeClustering,
-            affinity='euclidean',
-            linkage='ward'
+    return ModelFactory.fixed_clusters(
+        model_class,
+        n_clusters,
+        **model_kwargs
+    )
+
+
+def _reducer(name: str, n_components: int):
+    if name == 'pca':
+        from sklearn.decomposition import IncrementalPCA
+        return IncrementalPCA(n_components=n_components)
+    if name == 'random-projection':
+        from sklearn.random_projection import SparseRandomProjection
+        return SparseRandomProjection(
+            n_components=n_components,
+            dense_output=True,
+            random_state=0
         )
+    return None
+
+
+def _parse_part(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        part, n_parts = map(int, value.split('/'))
+    except ValueError:
+        raise click.BadParameter("expected format: i/N")
+    if not 0 <= part < n_parts:
+        raise click.BadParameter("expected 0 <= i < N")
+    return part, n_parts
+
+
+@main.command(name="vectorize")
+@click.argument("input_file", type=Path, required=True)
+@click.option(
+    "-o", "--output-file", type=Path, required=True,
+    help="Feature shard file (.npz).")
+@click.option(
+    "--part", callback=_parse_part, default="0/1",
+    help="Vectorize only part i out of N (0 <= i < N) of images.")
+@click.option(
+    "-j", "--jobs", type=int, default=1,
+    help="Number of processes used for vectorization (-1 = all CPUs).")
+@click.option(
+    "--read-threads", type=int, default=1,
+    help="Number of threads used for reading images (-1 = all CPUs).")
+@click.option(
+    "--float32/--float64", default=False,
+    help="Compute features in single precision (halves memory).")
+@click.option(
+    "--filter-shape", type=(int, int), default=(3, 3),
+    help="Shape of image chunks compared with IOU filters.")
+@click.option(
+    "--max-filters", type=int, default=None,
+    help="Compute IOU features for this many randomly sampled filters, "
+    "if there are more possible filters (required for shapes above 4x4).")
+@click.option("--verbose/--silent", default=True)
+def vectorize_images(
+        input_file, output_file, part, jobs, read_threads, float32,
+        filter_shape, max_filters, verbose
+):
+    """
+    Computes raw features of a part of images listed in the input file
+    (e.g. on one of many machines) into a feature shard,
+    for the cluster-features command.
+    """
+    import numpy as np
+    from image_cluster.pipeline import (
+        default_feature_extractors,
+        MetadataReader,
+        ShardVectorizer
+    )
+    try:
+        image_reader, vectorizer = default_feature_extractors(
+            verbose,
+            n_jobs=jobs,
+            read_threads=read_threads,
+            dtype=np.float32 if float32 else np.float64,
+            filter_shape=filter_shape,
+            max_filters=max_filters
+        )
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    ShardVectorizer(
+        image_reader,
+        vectorizer,
+        output_file,
+        shard=part[0],
+        n_shards=part[1],
+        verbose=verbose
+    ).transform(MetadataReader(input_file).metadata_)
+
+
+@main.command(name="cluster-features")
+@click.argument("shard_files", type=Path, nargs=-1, required=True)
+@click.option(
+    "-o", "--output-dir", type=Path,
+    help="Unless provided, output will be lost.")
+@click.option(
+    "-n", "--n-clusters", type=int, default=None,
+    help="Unless provided, will be autaomatically calculated.")
+@click.option(
+    "--html/--no-html", default=True,
+    help="Whether to save output in html format or only in text format.")
+@click.option("--verbose/--silent", default=True)
+@click.option(
+    "--score/--no-score", default=True,
+    help="Calculate metrics after fitting the model.")
+@click.option(
+    "--score-sample", type=int, default=None,
+    help="Estimate silhouette score from a sample of this size "
+    "(stratified over clusters). Unless provided, computed exactly.")
+@click.option(
+    "--model", type=click.Choice(['ward', 'two-stage']), default='ward',
+    help="Exact ward clustering, or ward clustering of micro-cluster "
+    "centroids (for large datasets).")
+@click.option(
+    "--micro-clusters", type=int, default=2000,
+    help="Number of micro-clusters used by the two-stage model.")
+@click.option(
+    "--reduce", type=click.Choice(REDUCERS), default='none',
+    help="Dimensionality reduction applied after feature scaling.")
+@click.option(
+    "--n-components", type=int, default=64,
+    help="Number of dimensions after reduction.")
+def cluster_features(
+        shard_files, output_dir, n_clusters, html, verbose, score,
+        score_sample, model, micro_clusters, reduce, n_components
+):
+    """
+    Merges feature shards saved by the vectorize command, and clusters
+    them like the cluster command (with the same results).
+    Model for the assign command is not saved.
+    """
+    from image_cluster.pipeline import (
+        feature_shard_transformers,
+        Pipeline,
+        Writer
+    )
+    writer = None if output_dir is None else Writer(output_dir, html, verbose)
+    preprocessing, postprocessing = feature_shard_transformers(
+        writer,
+        verbose,
+        reducer=_reducer(reduce, n_components)
+    )
     pipeline = Pipeline(
         preprocessing,
-        model_factory,
+        _model_factory(model, n_clusters, micro_clusters),
         postprocessing,
         verbose
     )
-    pipeline.fit_predict(input_file)
+    pipeline.fit_predict(shard_files)
     if score:
-        pipeline.score()
+        pipeline.score(score_sample)
     return pipeline  # for use in python scripts
 
 
+@main.command(name="assign")
+@click.argument("input_file", type=Path, required=True)
+@click.option(
+    "-o", "--output-dir", type=Path, required=True,
+    help="Output directory of a previous cluster command.")
+@click.option(
+    "--html/--no-html", default=True,
+    help="Whether to update output in html format (if it exists) "
+    "or only in text format.")
+@click.option(
+    "--outlier-factor", type=float, default=1.,
+    help="Images further from the nearest centroid than this many "
+    "cluster radii are reported as outliers.")
+@click.option("--verbose/--silent", default=True)
+def assign_images(input_file, output_dir, html, outlier_factor, verbose):
+    """
+    Assigns new images to clusters fitted by the cluster command,
+    without refitting the model. Images are appended to the output
+    in the given directory, candidate outliers are listed in outliers.txt.
+    Paginated report of the cluster command is not updated.
+    """
+    from image_cluster.pipeline import Assigner, Writer
+    assigner = Assigner.load(
+        output_dir / MODEL_FILE,
+        outlier_factor=outlier_factor,
+        verbose=verbose
+    )
+    clusters, outliers = assigner.transform(input_file)
+    Writer(output_dir, html, verbose).append(clusters, assigner.cluster_ids)
+    with open(output_dir / 'outliers.txt', 'a') as f:
+        f.writelines([f"{image.name}\n" for image in outliers])
+    return clusters, outliers  # for use in python scripts
+
+
+@main.command(name="serve")
+@click.argument("model_dir", type=Path, required=True)
+@click.option("--host", default='127.0.0.1')
+@click.option("--port", type=int, default=8080)
+@click.option(
+    "--socket", "socket_path", type=Path, default=None,
+    help="Listen on this Unix socket instead of the port.")
+@click.option(
+    "--max-batch", type=int, default=256,
+    help="Maximum number of images assigned together.")
+@click.option(
+    "--max-wait-ms", type=float, default=5.,
+    help="How long to wait for more requests before assigning a batch.")
+@click.option(
+    "--outlier-factor", type=float, default=1.,
+    help="Images further from the cluster centroid than "
+    "outlier factor * cluster radius are flagged as outliers.")
+@click.option(
+    "-j", "--jobs", type=int, default=1,
+    help="Number of processes used for vectorization (-1 = all CPUs).")
+@click.option("--verbose/--silent", default=False)
+def serve_model(
+        model_dir, host, port, socket_path, max_batch, max_wait_ms,
+        outlier_factor, jobs, verbose
+):
+    """
+    Serves the model fitted by the cluster command (saved in its output
+    directory) over localhost HTTP or a Unix socket, assigning images
+    to clusters: POST /assign {"paths": [...]} returns cluster ids,
+    distances and outlier flags, GET /stats returns throughput
+    and latency counters. Concurrent requests are assigned in batches.
+    """
+    from image_cluster.pipeline import Assigner
+    from image_cluster.server import BatchingAssigner, make_server
+    assigner = Assigner.load(
+        model_dir / MODEL_FILE,
+        n_jobs=jobs,
+        outlier_factor=outlier_factor,
+        verbose=False
+    )
+    batching_assigner = BatchingAssigner(
+        assigner,
+        max_batch,
+        max_wait_ms / 1000
+    )
+    server = make_server(
+        batching_assigner,
+        host=host,
+        port=port,
+        socket_path=None if socket_path is None else str(socket_path),
+        verbose=verbose
+    )
+    click.echo(f"Serving on {socket_path or f'http://{host}:{port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batching_assigner.close()
+        if socket_path is not None and socket_path.exists():
+            socket_path.unlink()
+
+
+@main.command(name="sweep")
+@click.argument("input_file", type=Path, required=True)
+@click.option("--k-min", type=int, default=40)
+@click.option("--k-max", type=int, default=120)
+@click.option("--k-step", type=int, default=1)
+@click.option(
+    "-o", "--output-file", type=Path, default=None,
+    help="Save scores for every number of clusters as csv.")
+@click.option(
+    "--score-sample", type=int, default=None,
+    help="Estimate silhouette scores from a sample of this size. "
+    "Unless provided, computed exactly.")
+@click.option(
+    "-j", "--jobs", type=int, default=1,
+    help="Number of processes used for vectorization (-1 = all CPUs).")
+@click.option(
+    "--read-threads", type=int, default=1,
+    help="Number of threads used for reading images (-1 = all CPUs).")
+@click.option(
+    "--cache-dir", type=Path, default=None,
+    help="Directory for caching image features between runs.")
+@click.option("--verbose/--silent", default=True)
+def sweep_clusters(
+        input_file, k_min, k_max, k_step, output_file, score_sample, jobs,
+        read_threads, cache_dir, verbose
+):
+    """
+    Scores ward clustering for a range of numbers of clusters
+    (from a single merge tree) and recommends the best one.
+    """
+    from image_cluster.pipeline import default_transformers, Sweep
+    preprocessing, _ = default_transformers(
+        None,
+        verbose,
+        n_jobs=jobs,
+        read_threads=read_threads,
+        cache_dir=cache_dir
+    )
+    sweep = Sweep(
+        preprocessing,
+        range(k_min, k_max + 1, k_step),
+        score_sample,
+        verbose
+    )
+    try:
+        sweep.fit(input_file)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    scores = sweep.score()
+    click.echo("n_clusters  silhouette  calinski_harabaz  size_min  size_max")
+    for score in scores:
+        click.echo(
+            f"{score.n_clusters:10d}  {score.silhouette_score:10.4f}  "
+            f"{score.calinski_harabaz_score:16.2f}  "
+            f"{score.label_size_min:8d}  {score.label_size_max:8d}"
+        )
+    click.echo(f"Recommended number of clusters: {sweep.recommended_}")
+    if output_file is not None:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(asdict(scores[0])))
+            writer.writeheader()
+            writer.writerows([asdict(score) for score in scores])
+    return sweep  # for use in python scripts
+
+
+@main.command(name="search")
+@click.argument("input_file", type=Path, required=True)
+@click.argument("grid_file", type=Path, required=True)
+@click.option(
+    "-o", "--output-file", type=Path, default=None,
+    help="Save ranked scores of all configurations as csv.")
+@click.option(
+    "--top", type=int, default=10,
+    help="Number of best configurations to print.")
+@click.option(
+    "--score-sample", type=int, default=None,
+    help="Estimate silhouette scores from a sample of this size. "
+    "Unless provided, computed exactly.")
+@click.option(
+    "-j", "--jobs", type=int, default=1,
+    help="Number of processes used for vectorization and "
+    "evaluation of configurations (-1 = all CPUs).")
+@click.option(
+    "--read-threads", type=int, default=1,
+    help="Number of threads used for reading images (-1 = all CPUs).")
+@click.option("--verbose/--silent", default=True)
+def search_configurations(
+        input_file, grid_file, output_file, top, score_sample, jobs,
+        read_threads, verbose
+):
+    """
+    Scores every pipeline configuration from the grid (json file with
+    lists of values of parameters: reader, vectorizer, filter_shape,
+    features, scaler, reducer, n_components, model, n_clusters,
+    eps, min_samples - or a list of such grids), computing features
+    once for every distinct reader, vectorizer and filter shape.
+    """
+    import json
+    from dataclasses import fields
+    from image_cluster.pipeline import Search
+    from image_cluster.types import Score
+    with open(grid_file) as f:
+        grid = json.load(f)
+    search = Search(
+        grid,
+        sample_size=score_sample,
+        n_jobs=jobs,
+        read_threads=read_threads,
+        verbose=verbose
+    ).fit(input_file)
+    results = search.results()
+    click.echo("rank  silhouette  calinski_harabaz  configuration")
+    for rank, (config, score, error) in enumerate(results[:top], 1):
+        if score is None:
+            click.echo(f"{rank:4d}  failed: {error}  {config}")
+            continue
+        click.echo(
+            f"{rank:4d}  {score.silhouette_score:10.4f}  "
+            f"{score.calinski_harabaz_score:16.2f}  {config}"
+        )
+    if output_file is not None:
+        score_fields = [field.name for field in fields(Score)]
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(
+                f,
+                # n_clusters of the score is the actual number of clusters
+                fieldnames=list(dict.fromkeys(
+                    ['rank', *results[0][0], *score_fields, 'error']
+                ))
+            )
+            writer.writeheader()
+            for rank, (config, score, error) in enumerate(results, 1):
+                row = dict(config, rank=rank, error=error)
+                if score is not None:
+                    row.update(asdict(score))
+                writer.writerow(row)
+    return search  # for use in python scripts
+
+
+@main.command(name="pack")
+@click.argument("input_file", type=Path, required=True)
+@click.option(
+    "-o", "--output-dir", type=Path, required=True,
+    help="Shard directory.")
+@click.option(
+    "--mode", type=click.Choice(SHARD_MODES), default='greyscale',
+    help="Store greyscale pixels (used by the cluster command), "
+    "or binary masks.")
+@click.option(
+    "--read-threads", type=int, default=1,
+    help="Number of threads used for reading images (-1 = all CPUs).")
+@click.option("--verbose/--silent", default=True)
+def pack_images(input_file, output_dir, mode, read_threads, verbose):
+    """
+    Decodes images listed in the metadata file once, and packs them
+    into a shard, that can be read by cluster --shard
+    without decoding image files again.
+    """
+    from image_cluster.pipeline import ImagePacker, MetadataReader
+    ImagePacker(
+        output_dir,
+        mode=mode,
+        n_threads=read_threads,
+        verbose=verbose
+    ).transform(MetadataReader(input_file).metadata_)
+
+
 @main.command(name="meta")
 @click.argument("images_dir", type=Path, required=True)
 @click.option("-o", "--output-file", type=Path, required=True)
-@click.option("-n", "--n-images", type=int, default=-1)
-def generate_meta(images_dir, output_file, n_images):
+@click.option(
+    "-n", "--n-images", type=int, default=-1,
+    help="Sample this many images uniformly (all images if not positive).")
+@click.option(
+    "-r", "--recursive/--no-recursive", default=False,
+    help="Include images from subdirectories.")
+@click.option(
+    "--pattern", multiple=True,
+    help="Only include files with names matching this glob pattern "
+    "(can be used multiple times).")
+@click.option(
+    "--extension", multiple=True,
+    help="Only include files with this extension "
+    "(can be used multiple times).")
+@click.option("--seed", type=int, default=None, help="Sampling seed.")
+def generate_meta(
+        images_dir, output_file, n_images, recursive, pattern, extension, seed
+):
     """
     Helper method for generating metadata from a folder of images.
     Generated metadata is compatible with the task specification.
+    Directory is scanned lazily, so only the sample (if any)
+    is kept in memory (path of the metadata file is returned).
     """
+    from image_cluster.meta import reservoir_sample, scan_images
     images_dir = images_dir.resolve(strict=True)
-    img_names = os.listdir(images_dir)
+    img_paths = scan_images(
+        str(images_dir),
+        recursive=recursive,
+        patterns=pattern,
+        extensions=extension
+    )
     if n_images > 0:
-        img_names = random.sample(img_names, n_images)
-    meta = [str(images_dir / img) + '\n' for img in img_names]
+        img_paths = reservoir_sample(img_paths, n_images, random_state=seed)
     with open(output_file, 'w') as f:
-        f.writelines(meta)
-    return meta  # for use in python scripts
+        for img_path in img_paths:
+            f.write(img_path + '\n')
+    return output_file  # for use in python scripts
 
 
 if __name__ == '__main__':
@@ -0,0 +1,56 @@
+from http.client import HTTPConnection
+from typing import Dict, List
+import json
+import socket
+
+
+class Client(object):
+    """
+    Minimal client of the serve command (over localhost HTTP
+    or a Unix socket), keeping a single connection open.
+    """
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 8080,
+            socket_path: str = None,
+            timeout: float = 60.
+    ):
+        if socket_path is None:
+            self.connection = HTTPConnection(host, port, timeout=timeout)
+        else:
+            self.connection = _UnixHTTPConnection(socket_path, timeout)
+
+    def assign(self, paths: List[str]) -> Dict[str, list]:
+        return self._request('POST', '/assign', dict(paths=list(paths)))
+
+    def stats(self) -> Dict[str, float]:
+        return self._request('GET', '/stats')
+
+    def close(self):
+        self.connection.close()
+
+    def _request(self, method: str, path: str, body: dict = None) -> dict:
+        content = None if body is None else json.dumps(body)
+        self.connection.request(
+            method,
+            path,
+            body=content,
+            headers={'Content-Type': 'application/json'}
+        )
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(result.get('error', response.reason))
+        return result
+
+
+class _UnixHTTPConnection(HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
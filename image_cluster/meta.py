@@ -0,0 +1,61 @@
+from fnmatch import fnmatch
+from typing import Iterable, Iterator, List, Sequence
+import os
+import random
+
+
+def scan_images(
+        images_dir: str,
+        recursive: bool = False,
+        patterns: Sequence[str] = (),
+        extensions: Sequence[str] = ()
+) -> Iterator[str]:
+    """
+    Lazily yields paths of files in images_dir (and its subdirectories,
+    if recursive), using os.scandir, so that the listing is never
+    held in memory. Files can be filtered by glob patterns
+    (matched against file names) and extensions (case insensitive).
+    """
+    extensions = tuple(
+        '.' + ext.lower().lstrip('.') for ext in extensions
+    )
+    directories = [images_dir]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        directories.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                if patterns and not any(
+                        fnmatch(entry.name, pattern) for pattern in patterns
+                ):
+                    continue
+                if extensions and \
+                        not entry.name.lower().endswith(extensions):
+                    continue
+                yield entry.path
+
+
+def reservoir_sample(
+        items: Iterable[str],
+        n_samples: int,
+        random_state: int = None
+) -> List[str]:
+    """
+    Uniformly samples n_samples items in a single pass (algorithm R),
+    keeping only the sample in memory.
+    If there are fewer items, all of them are returned.
+    """
+    rng = random.Random(random_state)
+    sample = []
+    for idx, item in enumerate(items):
+        if idx < n_samples:
+            sample.append(item)
+        else:
+            pos = rng.randint(0, idx)
+            if pos < n_samples:
+                sample[pos] = item
+    return sample
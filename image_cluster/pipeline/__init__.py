@@ -1,43 +1,57 @@
-from .utils import optimal_clusters
-from .pipeline import Pipeline
-from .reader import (
-    MetadataReader,
-    GreyscaleImageReader,
-    MaskImageReader
-)
-from .vectorizer import (
-    FilterImageVectorizer,
-    IOUImageVectorizer,
-    ShapeVectorizer,
-    TextDensityVectorizer
-)
-from .model_factory import ModelFactory
-from .converter import Converter
-from .writer import Writer
+"""
+Public names of the package are imported from their modules on first use,
+so that commands import only the dependencies they need.
+"""
+from importlib import import_module
 
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.pipeline import (
-    Pipeline as SklearnPipeline,
-    FeatureUnion
-)
 
+_EXPORTS = {
+    'optimal_clusters': 'utils',
+    'Pipeline': 'pipeline',
+    'MetadataReader': 'reader',
+    'GreyscaleImageReader': 'reader',
+    'MaskImageReader': 'reader',
+    'RawImageReader': 'reader',
+    'PackedImageReader': 'reader',
+    'ImagePacker': 'reader',
+    'ImageReadError': 'reader',
+    'ImageReleaser': 'reader',
+    'FilterImageVectorizer': 'vectorizer',
+    'FusedImageVectorizer': 'vectorizer',
+    'HashedFilterImageVectorizer': 'vectorizer',
+    'IOUImageVectorizer': 'vectorizer',
+    'ShapeVectorizer': 'vectorizer',
+    'TextDensityVectorizer': 'vectorizer',
+    'ModelFactory': 'model_factory',
+    'TwoStageClustering': 'model',
+    'WeightedWardClustering': 'model',
+    'Converter': 'converter',
+    'Writer': 'writer',
+    'CachedFeatureExtractor': 'cache',
+    'FeatureCache': 'cache',
+    'Deduplicator': 'dedup',
+    'StreamingFeatureExtractor': 'streaming',
+    'FeatureShardReader': 'sharding',
+    'ShardVectorizer': 'sharding',
+    'Assigner': 'assigner',
+    'Sweep': 'sweep',
+    'Search': 'search',
+    'Tracer': 'trace',
+    'default_feature_extractors': 'defaults',
+    'default_transformers': 'defaults',
+    'feature_shard_transformers': 'defaults',
+}
 
-def default_transformers(writer: Writer, verbose: bool):
-    preprocessing = SklearnPipeline([
-        ('meta', MetadataReader()),
-        ('image', GreyscaleImageReader(verbose=verbose)),
-        ('vectorizer', FeatureUnion([
-            ('iou', IOUImageVectorizer(filter_shape=(3, 3), verbose=verbose)),
-            ('shape', ShapeVectorizer(verbose=verbose)),
-            ('density', TextDensityVectorizer(verbose=verbose))
-        ])),
-        ('scaler', MinMaxScaler()),
-    ])
-    postprocessing = SklearnPipeline([
-        ('converter', Converter(
-            image_reader=preprocessing.named_steps['image'],
-            verbose=verbose
-        )),
-        ('writer', writer),
-    ])
-    return preprocessing, postprocessing
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
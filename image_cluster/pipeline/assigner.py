@@ -0,0 +1,217 @@
+from pathlib import Path
+from typing import List, Tuple, Union
+import pickle
+
+from sklearn.base import TransformerMixin, clone
+from sklearn.pipeline import Pipeline as SklearnPipeline, FeatureUnion
+from scipy.sparse import csr_matrix
+import numpy as np
+
+from image_cluster.pipeline.dedup import Deduplicator
+from image_cluster.pipeline.reader import ImageReleaser, PackedImageReader
+from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
+from image_cluster.types import ClusterData, ImageData
+
+
+# upper bound for the number of distances kept in memory at once
+MAX_BLOCK_ELEMENTS = 2**24
+
+
+class Assigner(VerboseMixin):
+    """
+    Fitted clustering artifact: preprocessing (readers, vectorizers and
+    fitted scaler), cluster centroids and their radii. Assigns new images
+    to the nearest centroid without refitting the model, images further
+    from the centroid than outlier_factor * radius are flagged as outliers.
+    """
+    def __init__(
+            self,
+            preprocessing: TransformerMixin,
+            cluster_ids: np.array,
+            centroids: np.array,
+            radii: np.array,
+            outlier_factor: float = 1.,
+            verbose: bool = False
+    ):
+        self.preprocessing = preprocessing
+        self.cluster_ids = cluster_ids
+        self.centroids = centroids
+        self.radii = radii
+        self.outlier_factor = outlier_factor
+        self.verbose = verbose
+
+    @classmethod
+    def from_pipeline(cls, pipeline, **kwargs):
+        """
+        Creates artifact from a fitted image_cluster Pipeline.
+        Centroids of deduplicated pipelines are weighted by group sizes.
+        """
+        cluster_ids, labels = np.unique(
+            pipeline.row_labels_,
+            return_inverse=True
+        )
+        X = pipeline.preprocessed_
+        weights = np.ones(len(X)) if pipeline.deduplicator is None \
+            else pipeline.deduplicator.counts_
+        membership = csr_matrix((weights, (labels, np.arange(len(X)))))
+        centroids = membership @ X / np.asarray(
+            membership.sum(axis=1)
+        ).ravel()[:, np.newaxis]
+        counts = np.bincount(labels)
+        distances = np.zeros(len(X))
+        block_size = max(1, MAX_BLOCK_ELEMENTS // X.shape[1])
+        for start in range(0, len(X), block_size):
+            block = slice(start, start + block_size)
+            distances[block] = np.linalg.norm(
+                X[block] - centroids[labels[block]],
+                axis=1
+            )
+        radii = np.zeros(len(cluster_ids))
+        np.maximum.at(radii, labels, distances)
+        # singleton clusters get typical radius instead of 0
+        singletons = counts == 1
+        if not np.all(singletons):
+            radii[singletons] = np.median(radii[~singletons])
+        return cls(
+            _fitted_preprocessing(pipeline.preprocessing),
+            cluster_ids,
+            centroids,
+            radii,
+            verbose=pipeline.verbose,
+            **kwargs
+        )
+
+    @classmethod
+    def load(cls, path: Path, n_jobs: int = None, **kwargs):
+        """
+        Loads saved artifact, overriding its attributes with kwargs.
+        Verbosity and (if given) n_jobs are also set in preprocessing.
+        """
+        with open(path, 'rb') as f:
+            assigner = pickle.load(f)
+        for key, value in kwargs.items():
+            setattr(assigner, key, value)
+        nested = {}
+        if 'verbose' in kwargs:
+            nested['verbose'] = kwargs['verbose']
+        if n_jobs is not None:
+            nested['n_jobs'] = n_jobs
+        params = assigner.preprocessing.get_params(deep=True)
+        assigner.preprocessing.set_params(**{
+            key: nested[name]
+            for key in params
+            for name in nested if key.endswith(f'__{name}')
+        })
+        return assigner
+
+    def save(self, path: Path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    def predict(self, X) -> Tuple[np.array, np.array]:
+        """
+        Returns cluster ids and distances to the nearest centroid.
+        """
+        self._log("Preprocessing...")
+        features = self.preprocessing.transform(X)
+        self._log("Assigning...")
+        return self.nearest_centroids(features)
+
+    def predict_images(
+            self,
+            image_data: List[ImageData]
+    ) -> Tuple[np.array, np.array]:
+        """
+        Like predict, but for already listed images
+        (skipping the metadata reader, first step of preprocessing).
+        """
+        features = SklearnPipeline(
+            self.preprocessing.steps[1:]
+        ).transform(image_data)
+        return self.nearest_centroids(features)
+
+    def outliers(self, labels: np.array, distances: np.array) -> np.array:
+        """
+        Flags images further than outlier_factor * radius from centroids.
+        """
+        thresholds = self.outlier_factor * self.radii[
+            np.searchsorted(self.cluster_ids, labels)
+        ]
+        return distances > thresholds
+
+    def transform(
+            self,
+            X
+    ) -> Tuple[List[ClusterData], List[ImageData]]:
+        """
+        Assigns images to clusters, returns ClusterData of clusters
+        with new images and the list of candidate outliers.
+        """
+        labels, distances = self.predict(X)
+        # metadata reader is the first step of preprocessing
+        images = self.preprocessing.steps[0][1].metadata_
+        cluster_data = {}
+        for image, label in zip(images, labels):
+            image.cluster = label
+            cluster_data.setdefault(label, ClusterData(label))
+            cluster_data[label].images.append(image)
+        outliers = [
+            image for image, outlier
+            in zip(images, self.outliers(labels, distances))
+            if outlier
+        ]
+        self._log(f"Assigned {len(images)} images, {len(outliers)} outliers")
+        return [cluster_data[key] for key in sorted(cluster_data)], outliers
+
+    def nearest_centroids(
+            self,
+            features: np.array
+    ) -> Tuple[np.array, np.array]:
+        centroid_norms = np.sum(self.centroids ** 2, axis=1)
+        nearest = np.zeros(len(features), dtype=np.intp)
+        distances = np.zeros(len(features))
+        block_size = max(1, MAX_BLOCK_ELEMENTS // len(self.centroids))
+        for start in range(0, len(features), block_size):
+            block = slice(start, start + block_size)
+            squared = features[block] @ self.centroids.T
+            squared *= -2
+            squared += centroid_norms
+            squared += np.sum(features[block] ** 2, axis=1)[:, np.newaxis]
+            block_nearest = np.argmin(squared, axis=1)
+            nearest[block] = block_nearest
+            distances[block] = np.sqrt(np.maximum(
+                squared[np.arange(len(squared)), block_nearest],
+                0
+            ))
+        return self.cluster_ids[nearest], distances
+
+
+def _fitted_preprocessing(
+        preprocessing: SklearnPipeline
+) -> SklearnPipeline:
+    """
+    Copies preprocessing without data stored by stateless transformers
+    (images, vectors), keeping fitted transformers such as scalers.
+    Shard readers are replaced by readers decoding image files.
+    """
+    fitted = SklearnPipeline([
+        (name, clone(step) if _is_stateless(step) else step)
+        for name, step in preprocessing.steps
+        # releasing pixels makes no difference when assigning,
+        # and every assigned image needs its own features
+        if not isinstance(step, (ImageReleaser, Deduplicator))
+    ])
+    # new images are not in the shard of fitted images
+    for name, param in fitted.get_params(deep=True).items():
+        if isinstance(param, PackedImageReader):
+            fitted.set_params(**{name: param.decoding_reader()})
+    return fitted
+
+
+def _is_stateless(estimator: Union[TransformerMixin, NoFitMixin]) -> bool:
+    if isinstance(estimator, FeatureUnion):
+        return all(
+            _is_stateless(transformer)
+            for _, transformer in estimator.transformer_list
+        )
+    return isinstance(estimator, NoFitMixin)
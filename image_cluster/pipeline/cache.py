@@ -0,0 +1,191 @@
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, Iterable
+import os
+import time
+
+from sklearn.base import BaseEstimator, TransformerMixin
+import numpy as np
+
+from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
+from image_cluster.types import ImageData
+
+
+# parameters that affect how features are computed, but not their values
+_RUNTIME_PARAMS = {'verbose', 'n_jobs', 'n_threads'}
+
+
+class FeatureCache(object):
+    """
+    On-disk cache of feature rows, keyed by image path, size and mtime.
+    Every feature configuration (reader and vectorizer classes with their
+    parameters) is stored in a single .npz file in the cache directory.
+    When the directory grows over max_size bytes, least recently used
+    configurations are removed first, then least recently used rows.
+    """
+    def __init__(self, cache_dir: Path, max_size: int = 2**30):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+
+    def load(self, config: str) -> Dict[str, np.array]:
+        path = self._path(config)
+        if not path.is_file():
+            return {}
+        with np.load(path) as data:
+            return dict(zip(data['keys'], data['features']))
+
+    def save(self, config: str, entries: Dict[str, np.array]):
+        """
+        Stores given entries, marking them as most recently used.
+        """
+        if not entries:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(config)
+        keys, features, last_used = self._read(path)
+        positions = dict(zip(keys, range(len(keys))))
+        new_keys = [key for key in entries if key not in positions]
+        if new_keys:
+            new_features = np.array([entries[key] for key in new_keys])
+            if len(keys):
+                features = np.concatenate([features, new_features])
+            else:
+                features = new_features
+            keys = np.concatenate([keys, np.array(new_keys, dtype=str)])
+            last_used = np.concatenate([last_used, np.zeros(len(new_keys))])
+            positions = dict(zip(keys, range(len(keys))))
+        last_used[[positions[key] for key in entries]] = time.time()
+        keys, features, last_used = self._evict(
+            path, keys, features, last_used
+        )
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, keys=keys, features=features, last_used=last_used)
+        os.replace(tmp_path, path)
+
+    def _evict(self, path: Path, keys, features, last_used):
+        others = sorted(
+            (p for p in self.cache_dir.glob('features-*.npz') if p != path),
+            key=lambda p: p.stat().st_mtime
+        )
+        used = sum(p.stat().st_size for p in others)
+        size = keys.nbytes + features.nbytes + last_used.nbytes
+        while others and used + size > self.max_size:
+            oldest = others.pop(0)
+            used -= oldest.stat().st_size
+            oldest.unlink()
+        if size > self.max_size:
+            row_size = size / len(keys)
+            keep = np.sort(
+                np.argsort(-last_used)[:int(self.max_size // row_size)]
+            )
+            keys, features, last_used = (
+                keys[keep], features[keep], last_used[keep]
+            )
+        return keys, features, last_used
+
+    def _read(self, path: Path):
+        if not path.is_file():
+            return np.array([], dtype=str), np.zeros(0), np.zeros(0)
+        with np.load(path) as data:
+            return data['keys'], data['features'], data['last_used']
+
+    def _path(self, config: str) -> Path:
+        return self.cache_dir / f"features-{config}.npz"
+
+
+class CachedFeatureExtractor(
+        BaseEstimator,
+        TransformerMixin,
+        NoFitMixin,
+        VerboseMixin
+):
+    """
+    Wraps image reader and vectorizer, reusing feature rows
+    stored in FeatureCache. Only new or modified images are read
+    and vectorized. Exposes images_ like image readers do.
+    """
+    def __init__(
+            self,
+            image_reader: TransformerMixin,
+            vectorizer: TransformerMixin,
+            cache_dir: Path,
+            max_cache_size: int = 2**30,
+            verbose: bool = False
+    ):
+        self.image_reader = image_reader
+        self.vectorizer = vectorizer
+        self.cache_dir = cache_dir
+        self.max_cache_size = max_cache_size
+        self.verbose = verbose
+
+    def transform(self, image_data: Iterable[ImageData]) -> np.array:
+        self.images_ = list(image_data)
+        cache = FeatureCache(self.cache_dir, self.max_cache_size)
+        config = self.config_key()
+        cached = cache.load(config)
+        keys = [image_key(img.path) for img in self.images_]
+        missing = [
+            idx for idx, key in enumerate(keys)
+            if key is None or key not in cached
+        ]
+        self._log(
+            f"{len(keys) - len(missing)} cached, {len(missing)} to compute"
+        )
+        computed = {}
+        if missing:
+            images = self.image_reader.fit_transform(
+                [self.images_[idx] for idx in missing]
+            )
+            features = self.vectorizer.fit_transform(images)
+            computed = dict(zip(missing, features))
+        self.features_ = np.array([
+            computed[idx] if idx in computed else cached[key]
+            for idx, key in enumerate(keys)
+        ])
+        cache.save(config, {
+            key: self.features_[idx]
+            for idx, key in enumerate(keys) if key is not None
+        })
+        return self.features_
+
+    def config_key(self) -> str:
+        """
+        Hash of reader and vectorizer classes and parameters.
+        """
+        return config_key([self.image_reader, self.vectorizer])
+
+
+def config_key(estimators: Iterable[BaseEstimator]) -> str:
+    """
+    Hash of estimator classes and parameters that affect feature values.
+    """
+    config = repr(_describe(list(estimators)))
+    return sha1(config.encode()).hexdigest()[:16]
+
+
+def image_key(path: Path) -> str:
+    """
+    Identifies image file contents by path, size and modification time,
+    returns None for files that can't be accessed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _describe(value) -> object:
+    if hasattr(value, 'get_params'):
+        params = value.get_params(deep=False)
+        return (
+            f"{type(value).__module__}.{type(value).__qualname__}",
+            sorted(
+                (key, _describe(params[key]))
+                for key in params if key not in _RUNTIME_PARAMS
+            )
+        )
+    if isinstance(value, (list, tuple)):
+        return [_describe(item) for item in value]
+    return repr(value)
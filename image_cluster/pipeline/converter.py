@@ -4,8 +4,8 @@ from sklearn.base import BaseEstimator, TransformerMixin
 import numpy as np
 
 from image_cluster.pipeline.utils import VerboseMixin
-from image_cluster.pipeline.reader import BaseImageReader
-from image_cluster.types import ClusterData
+from image_cluster.pipeline.reader import BaseImageReader, MetadataReader
+from image_cluster.types import ClusterData, ImageTable
 
 
 class Converter(
@@ -16,9 +16,21 @@ class Converter(
     """
     Converts raw cluster data to ClusterData objects, updating
     initially read images with cluster ids in the process.
+    In low-memory mode, images of each cluster are stored
+    in a compact ImageTable replacing the list of ImageData objects,
+    which is dropped from image_reader (and its nested readers)
+    and metadata_reader.
     """
-    def __init__(self, image_reader: BaseImageReader, verbose: bool = False):
+    def __init__(
+            self,
+            image_reader: BaseImageReader,
+            low_memory: bool = False,
+            metadata_reader: MetadataReader = None,
+            verbose: bool = False
+    ):
         self.image_reader = image_reader
+        self.low_memory = low_memory
+        self.metadata_reader = metadata_reader
         self.verbose = verbose
 
     def fit(self, raw_cluster_data: np.array):
@@ -39,10 +51,31 @@ class Converter(
         if raw_cluster_data is not None:
             # re-fit the model in case there are new clusters
             self.fit(raw_cluster_data)
-        for image, cluster_id in self._progress(zip(
-                self.image_reader.images_,
-                self.raw_cluster_data_
-        )):
-            image.cluster = cluster_id
-            self.cluster_data_[cluster_id].images.append(image)
+        labels = np.asarray(self.raw_cluster_data_)
+        # stable sort keeps the input order of images within clusters
+        order = np.argsort(labels, kind='stable')
+        cluster_ids, starts = np.unique(labels[order], return_index=True)
+        groups = np.split(order, starts[1:])
+        images = self.image_reader.images_
+        if self.low_memory:
+            images = ImageTable.from_images(images, labels)
+            self._drop_records()
+        for cluster_id, indices in self._progress(zip(cluster_ids, groups)):
+            if self.low_memory:
+                cluster_images = images[indices]
+            else:
+                cluster_images = [images[idx] for idx in indices]
+                for image in cluster_images:
+                    image.cluster = cluster_id
+            self.cluster_data_[cluster_id].images = cluster_images
         return [self.cluster_data_[key] for key in self.cluster_data_]
+
+    def _drop_records(self):
+        readers = [self.image_reader, self.metadata_reader] + [
+            param for param in self.image_reader.get_params(deep=True).values()
+            if isinstance(param, BaseImageReader)
+        ]
+        for reader in readers:
+            for name in ('images_', 'metadata_'):
+                if hasattr(reader, name):
+                    delattr(reader, name)
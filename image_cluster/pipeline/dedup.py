@@ -0,0 +1,141 @@
+from collections import defaultdict
+from hashlib import blake2b
+from typing import Dict, Iterable, List, Optional
+
+from sklearn.base import BaseEstimator, TransformerMixin
+import cv2 as cv
+import numpy as np
+
+from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
+from image_cluster.types import ImageData
+
+
+class Deduplicator(
+        BaseEstimator,
+        TransformerMixin,
+        NoFitMixin,
+        VerboseMixin
+):
+    """
+    Collapses duplicate images (read by an image reader) into groups,
+    passing only the first image of every group (its representative).
+    Exact duplicates have identical shape and pixels (quantized to 8 bits),
+    near duplicates - perceptual difference hashes (dHash) that differ
+    from a representative's hash by at most hamming_threshold bits
+    (near duplicates are not collapsed unless the threshold is given).
+    After transform, counts_ (group sizes, used as sample weights)
+    and inverse_ (group of every image) are available.
+    """
+    def __init__(
+            self,
+            hamming_threshold: int = None,
+            verbose: bool = False
+    ):
+        self.hamming_threshold = hamming_threshold
+        self.verbose = verbose
+
+    def transform(
+            self,
+            image_data: Iterable[ImageData]
+    ) -> List[ImageData]:
+        image_data = list(image_data)
+        exact_groups = {}
+        if self.hamming_threshold is None:
+            near_groups = None
+        else:
+            near_groups = HammingIndex(self.hamming_threshold)
+        representatives = []
+        self.inverse_ = np.empty(len(image_data), dtype=np.int64)
+        for idx, img in enumerate(self._progress(image_data)):
+            key = exact_hash(img.image)
+            group = exact_groups.get(key)
+            if group is None and near_groups is not None:
+                image_hash = difference_hash(img.image)
+                group = near_groups.query(image_hash)
+                if group is None:
+                    near_groups.add(image_hash, len(representatives))
+            if group is None:
+                group = len(representatives)
+                representatives.append(idx)
+            exact_groups.setdefault(key, group)
+            self.inverse_[idx] = group
+        self.representatives_ = np.array(representatives, dtype=np.int64)
+        self.counts_ = np.bincount(
+            self.inverse_,
+            minlength=len(representatives)
+        )
+        self._log(
+            f"Deduplication: {len(image_data) - len(representatives)} "
+            f"of {len(image_data)} images removed"
+        )
+        return [image_data[idx] for idx in representatives]
+
+    def expand(self, labels: np.array) -> np.array:
+        """
+        Maps labels of representatives to labels of all images.
+        """
+        return np.asarray(labels)[self.inverse_]
+
+
+class HammingIndex(object):
+    """
+    Finds 64-bit hashes within the Hamming distance threshold
+    from a query. Hashes are split into threshold + 1 bands,
+    (at least) one of which must be identical in any matching hash,
+    so only hashes sharing a band with the query are compared.
+    """
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        n_bands = min(threshold + 1, 64)
+        bounds = np.linspace(0, 64, n_bands + 1).astype(int).tolist()
+        self.band_masks = [
+            ((1 << (stop - start)) - 1) << start
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        self.buckets = [defaultdict(list) for _ in self.band_masks]
+        self.hashes: Dict[int, int] = {}
+
+    def add(self, image_hash: int, group: int):
+        self.hashes[group] = image_hash
+        for mask, bucket in zip(self.band_masks, self.buckets):
+            bucket[image_hash & mask].append(group)
+
+    def query(self, image_hash: int) -> Optional[int]:
+        """
+        Returns the first added group within the threshold, if any.
+        """
+        candidates = {
+            group
+            for mask, bucket in zip(self.band_masks, self.buckets)
+            for group in bucket.get(image_hash & mask, ())
+        }
+        for group in sorted(candidates):
+            distance = bin(self.hashes[group] ^ image_hash).count('1')
+            if distance <= self.threshold:
+                return group
+        return None
+
+
+def exact_hash(img: np.array) -> bytes:
+    """
+    Hash of image shape and pixels, quantized to 8 bits
+    (so that equal images read with any dtype hash the same).
+    """
+    pixels = np.round(np.asarray(img, dtype=np.float64) * 255)
+    digest = blake2b(str(img.shape).encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(pixels.astype(np.uint8)).tobytes())
+    return digest.digest()
+
+
+def difference_hash(img: np.array) -> int:
+    """
+    Perceptual 64-bit difference hash: image is downscaled to 9x8 pixels,
+    and every bit tells whether a pixel is greater than its right neighbour.
+    """
+    small = cv.resize(
+        np.asarray(img, dtype=np.float32),
+        (9, 8),
+        interpolation=cv.INTER_AREA
+    )
+    bits = (small[:, :-1] > small[:, 1:]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
@@ -0,0 +1,158 @@
+from pathlib import Path
+from typing import Tuple
+
+from sklearn.base import TransformerMixin
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.pipeline import Pipeline as SklearnPipeline
+import numpy as np
+
+from image_cluster.pipeline.cache import CachedFeatureExtractor
+from image_cluster.pipeline.converter import Converter
+from image_cluster.pipeline.dedup import Deduplicator
+from image_cluster.pipeline.reader import (
+    GreyscaleImageReader,
+    ImageReleaser,
+    MetadataReader,
+    PackedImageReader
+)
+from image_cluster.pipeline.sharding import FeatureShardReader
+from image_cluster.pipeline.streaming import StreamingFeatureExtractor
+from image_cluster.pipeline.vectorizer import FusedImageVectorizer
+from image_cluster.pipeline.writer import Writer
+
+
+def default_feature_extractors(
+        verbose: bool,
+        n_jobs: int = None,
+        read_threads: int = None,
+        dtype: type = np.float64,
+        shard_dir: Path = None,
+        filter_shape: Tuple[int, int] = (3, 3),
+        max_filters: int = None
+):
+    if shard_dir is None:
+        image_reader = GreyscaleImageReader(
+            dtype=dtype,
+            n_threads=read_threads,
+            verbose=verbose
+        )
+    else:
+        image_reader = PackedImageReader(
+            shard_dir,
+            dtype=dtype,
+            verbose=verbose
+        )
+    vectorizer = FusedImageVectorizer(
+        filter_shape=filter_shape,
+        features=('iou', 'shape', 'density'),
+        n_jobs=n_jobs,
+        dtype=dtype,
+        verbose=verbose,
+        max_filters=max_filters
+    )
+    return image_reader, vectorizer
+
+
+def default_transformers(
+        writer: Writer,
+        verbose: bool,
+        n_jobs: int = None,
+        read_threads: int = None,
+        cache_dir: Path = None,
+        max_cache_size: int = 2**30,
+        low_memory: bool = False,
+        dtype: type = np.float64,
+        reducer: TransformerMixin = None,
+        shard_dir: Path = None,
+        filter_shape: Tuple[int, int] = (3, 3),
+        max_filters: int = None,
+        deduplicate: bool = False,
+        hamming_threshold: int = None,
+        streaming: bool = False
+):
+    image_reader, vectorizer = default_feature_extractors(
+        verbose,
+        n_jobs=n_jobs,
+        read_threads=read_threads,
+        dtype=dtype,
+        shard_dir=shard_dir,
+        filter_shape=filter_shape,
+        max_filters=max_filters
+    )
+    if deduplicate and cache_dir is not None:
+        raise ValueError("Deduplication can't be used with feature cache")
+    if streaming and (deduplicate or cache_dir is not None):
+        raise ValueError(
+            "Streaming can't be used with deduplication or feature cache"
+        )
+    if streaming:
+        images_source = StreamingFeatureExtractor(
+            image_reader,
+            vectorizer,
+            verbose=verbose
+        )
+        feature_steps = [('features', images_source)]
+    elif cache_dir is None:
+        feature_steps = [('image', image_reader)]
+        if deduplicate:
+            feature_steps.append(('dedup', Deduplicator(
+                hamming_threshold=hamming_threshold,
+                verbose=verbose
+            )))
+        feature_steps.append(('vectorizer', vectorizer))
+        images_source = image_reader
+    else:
+        images_source = CachedFeatureExtractor(
+            image_reader,
+            vectorizer,
+            cache_dir,
+            max_cache_size,
+            verbose=verbose
+        )
+        feature_steps = [('features', images_source)]
+    if low_memory:
+        feature_steps.append(('release', ImageReleaser(images_source)))
+    reduction_steps = [] if reducer is None else [('reducer', reducer)]
+    metadata_reader = MetadataReader()
+    preprocessing = SklearnPipeline(
+        [('meta', metadata_reader)]
+        + feature_steps
+        + [('scaler', MinMaxScaler())]
+        + reduction_steps
+    )
+    postprocessing = SklearnPipeline([
+        ('converter', Converter(
+            image_reader=images_source,
+            low_memory=low_memory,
+            metadata_reader=metadata_reader,
+            verbose=verbose
+        )),
+        ('writer', writer),
+    ])
+    return preprocessing, postprocessing
+
+
+def feature_shard_transformers(
+        writer: Writer,
+        verbose: bool,
+        reducer: TransformerMixin = None
+):
+    """
+    Transformers for clustering features merged from shards
+    saved by ShardVectorizer (instead of reading images).
+    """
+    feature_reader = FeatureShardReader()
+    reduction_steps = [] if reducer is None else [('reducer', reducer)]
+    preprocessing = SklearnPipeline(
+        [('features', feature_reader)]
+        + [('scaler', MinMaxScaler())]
+        + reduction_steps
+    )
+    postprocessing = SklearnPipeline([
+        ('converter', Converter(
+            image_reader=feature_reader,
+            verbose=verbose
+        )),
+        ('writer', writer),
+    ])
+    return preprocessing, postprocessing
@@ -0,0 +1,234 @@
+from typing import List, NamedTuple, Tuple
+
+from scipy.sparse import csr_matrix
+import numpy as np
+
+from image_cluster.types import Score
+
+
+# upper bound for the number of distances kept in memory at once
+MAX_BLOCK_ELEMENTS = 2**24
+
+
+class SilhouetteEstimate(NamedTuple):
+    score: float
+    ci_low: float
+    ci_high: float
+    method: str
+
+
+def silhouette_estimate(
+        X: np.array,
+        labels: np.array,
+        sample_size: int = None,
+        random_state: int = 0
+) -> SilhouetteEstimate:
+    """
+    Computes silhouette score exactly (if sample_size is None or not smaller
+    than the number of samples) or estimates it from a sample stratified
+    over clusters, with 95% confidence interval.
+    Distances are computed in blocks of bounded size in both cases.
+    """
+    classes, inverse = np.unique(labels, return_inverse=True)
+    if not 2 <= len(classes) <= len(X) - 1:
+        raise ValueError(
+            f"Number of labels is {len(classes)}. "
+            f"Valid values are 2 to n_samples - 1 (inclusive)"
+        )
+    if sample_size is None or sample_size >= len(X):
+        values = silhouette_values(X, [inverse], np.arange(len(X)))[0]
+        score = np.mean(values)
+        return SilhouetteEstimate(score, score, score, 'exact')
+    rng = np.random.RandomState(random_state)
+    counts = np.bincount(inverse)
+    strata = np.split(
+        np.argsort(inverse, kind='stable'),
+        np.cumsum(counts)[:-1]
+    )
+    sample_sizes = np.minimum(
+        counts,
+        np.maximum(2, np.round(sample_size * counts / len(X))).astype(int)
+    )
+    rows = [
+        rng.choice(stratum, size, replace=False)
+        for stratum, size in zip(strata, sample_sizes)
+    ]
+    values = np.split(
+        silhouette_values(X, [inverse], np.concatenate(rows))[0],
+        np.cumsum(sample_sizes)[:-1]
+    )
+    weights = counts / len(X)
+    means = np.array([np.mean(v) for v in values])
+    variances = np.array([
+        np.var(v, ddof=1) if len(v) > 1 else 0. for v in values
+    ])
+    score = np.sum(weights * means)
+    error = 1.96 * np.sqrt(np.sum(
+        weights ** 2 * (1 - sample_sizes / counts) * variances / sample_sizes
+    ))
+    return SilhouetteEstimate(
+        score,
+        score - error,
+        score + error,
+        f'sampled ({np.sum(sample_sizes)} samples)'
+    )
+
+
+def silhouette_sweep(
+        X: np.array,
+        label_sets: List[np.array],
+        sample_size: int = None,
+        random_state: int = 0
+) -> List[SilhouetteEstimate]:
+    """
+    Computes silhouette scores of many labelings of the same data
+    (exactly or from a uniform sample of rows, shared by all labelings),
+    computing each block of distances only once.
+    """
+    if sample_size is None or sample_size >= len(X):
+        rows = np.arange(len(X))
+    else:
+        rows = np.sort(np.random.RandomState(random_state).choice(
+            len(X),
+            sample_size,
+            replace=False
+        ))
+    all_values = silhouette_values(
+        X,
+        [np.unique(labels, return_inverse=True)[1] for labels in label_sets],
+        rows
+    )
+    if len(rows) == len(X):
+        return [
+            SilhouetteEstimate(score, score, score, 'exact')
+            for score in np.mean(all_values, axis=1)
+        ]
+    estimates = []
+    for values in all_values:
+        score = np.mean(values)
+        error = 1.96 * np.std(values, ddof=1) / np.sqrt(len(rows)) * np.sqrt(
+            1 - len(rows) / len(X)
+        )
+        estimates.append(SilhouetteEstimate(
+            score,
+            score - error,
+            score + error,
+            f'sampled ({len(rows)} samples)'
+        ))
+    return estimates
+
+
+def silhouette_values(
+        X: np.array,
+        label_sets: List[np.array],
+        rows: np.array
+) -> np.array:
+    """
+    Computes exact silhouette values of selected rows, for each of label
+    sets (labels should be consecutive integers: 0 .. n_clusters - 1).
+    Returns array of shape (n_label_sets, n_rows).
+    """
+    memberships = [
+        csr_matrix((
+            np.ones(len(labels)),
+            (labels, np.arange(len(labels)))
+        ))
+        for labels in label_sets
+    ]
+    all_counts = [np.bincount(labels) for labels in label_sets]
+    squared_norms = np.sum(X ** 2, axis=1)
+    block_size = max(1, MAX_BLOCK_ELEMENTS // len(X))
+    values = np.zeros((len(label_sets), len(rows)))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start+block_size]
+        block_range = np.arange(len(block))
+        distances = X[block] @ X.T
+        distances *= -2
+        distances += squared_norms
+        distances += squared_norms[block, np.newaxis]
+        np.maximum(distances, 0, out=distances)
+        np.sqrt(distances, out=distances)
+        distances[block_range, block] = 0
+        for idx, (labels, membership, counts) in enumerate(
+                zip(label_sets, memberships, all_counts)
+        ):
+            sums = (membership @ distances.T).T
+            own = labels[block]
+            intra = sums[block_range, own] / np.maximum(counts[own] - 1, 1)
+            sums[block_range, own] = np.inf
+            inter = np.min(sums / counts, axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                block_values = (inter - intra) / np.maximum(intra, inter)
+            # silhouette of samples in singleton clusters is 0
+            block_values[counts[own] == 1] = 0
+            values[idx, start:start+block_size] = np.nan_to_num(block_values)
+    return values
+
+
+def cluster_statistics(
+        X: np.array,
+        labels: np.array
+) -> Tuple[float, np.array, np.array]:
+    """
+    Computes Calinski-Harabaz score together with cluster labels and sizes,
+    in a single pass over data (in blocks of bounded size).
+    """
+    classes, inverse = np.unique(labels, return_inverse=True)
+    n_samples, n_classes = len(X), len(classes)
+    counts = np.zeros(n_classes)
+    sums = np.zeros((n_classes, X.shape[1]))
+    squares = 0.
+    block_size = max(1, MAX_BLOCK_ELEMENTS // (X.shape[1] or 1))
+    for start in range(0, n_samples, block_size):
+        block = np.asarray(X[start:start+block_size], dtype=np.float64)
+        block_labels = inverse[start:start+block_size]
+        membership = csr_matrix((
+            np.ones(len(block)),
+            (block_labels, np.arange(len(block)))
+        ), shape=(n_classes, len(block)))
+        counts += np.bincount(block_labels, minlength=n_classes)
+        sums += membership @ block
+        squares += np.sum(block ** 2)
+    between = np.sum(np.sum(sums ** 2, axis=1) / counts)
+    within = squares - between
+    between -= np.sum(np.sum(sums, axis=0) ** 2) / n_samples
+    if within <= 0:
+        score = 1.
+    else:
+        score = between * (n_samples - n_classes) / (
+            within * (n_classes - 1)
+        )
+    return score, classes, counts.astype(int)
+
+
+def evaluate(
+        X: np.array,
+        labels: np.array,
+        n_clusters: int = None,
+        sample_size: int = None
+) -> Score:
+    """
+    Computes all metrics of clustering (label -1 denotes outliers).
+    Unless given, n_clusters is the number of distinct labels
+    (other than -1).
+    """
+    # checks the number of labels before computing other statistics
+    silhouette = silhouette_estimate(X, labels, sample_size)
+    calinski_harabaz, classes, counts = cluster_statistics(X, labels)
+    cluster_counts = counts[classes >= 0]
+    if n_clusters is None:
+        n_clusters = len(cluster_counts)
+    return Score(
+        silhouette_score=silhouette.score,
+        calinski_harabaz_score=calinski_harabaz,
+        n_samples=len(X),
+        n_clusters=n_clusters,
+        n_outliers=np.sum(counts[classes == -1]),
+        label_size_min=np.min(cluster_counts),
+        label_size_max=np.max(cluster_counts),
+        label_size_mean=np.mean(cluster_counts),
+        label_size_var=np.var(cluster_counts),
+        silhouette_method=silhouette.method,
+        silhouette_ci_low=silhouette.ci_low,
+        silhouette_ci_high=silhouette.ci_high
+    )
@@ -0,0 +1,164 @@
+from sklearn.base import BaseEstimator, ClusterMixin
+from sklearn.cluster import Birch, MiniBatchKMeans
+from scipy.sparse import csr_matrix
+import numpy as np
+
+
+class WeightedWardClustering(BaseEstimator, ClusterMixin):
+    """
+    Ward agglomerative clustering with sample weights,
+    a sample with weight w is treated as w identical samples.
+    Uses nearest-neighbor chain algorithm on a dense matrix of
+    Ward merge costs, so it needs O(n_samples^2) memory.
+    """
+    def __init__(self, n_clusters: int = 2):
+        self.n_clusters = n_clusters
+
+    def fit(self, X, y=None, sample_weight=None):
+        X = np.asarray(X, dtype=np.float64)
+        if sample_weight is None:
+            sample_weight = np.ones(len(X))
+        self.children_, self.distances_ = self._ward_tree(
+            X,
+            np.asarray(sample_weight, dtype=np.float64)
+        )
+        self.labels_ = cut_tree(self.children_, self.n_clusters)
+        return self
+
+    def fit_predict(self, X, y=None, sample_weight=None):
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+    def _ward_tree(self, X: np.array, weights: np.array):
+        """
+        Returns merged node pairs (leaves are 0..n-1, i-th merge creates
+        node n+i) and Ward criterion values, sorted by the criterion.
+        """
+        n_samples = len(X)
+        squared_norms = np.sum(X ** 2, axis=1)
+        # squared euclidean distances, computed in place
+        costs = X @ X.T
+        costs *= -2
+        costs += squared_norms[:, np.newaxis]
+        costs += squared_norms
+        np.maximum(costs, 0, out=costs)
+        for row, weight in enumerate(weights):
+            costs[row] *= weight * weights / (weight + weights)
+        np.fill_diagonal(costs, np.inf)
+        weights = weights.copy()
+        nodes = np.arange(n_samples)
+        active = np.ones(n_samples, dtype=np.bool_)
+        merges = []
+        chain = []
+        while len(merges) < n_samples - 1:
+            if not chain:
+                chain.append(int(np.flatnonzero(active)[0]))
+            a = chain[-1]
+            b = int(np.argmin(costs[a]))
+            if len(chain) > 1 and costs[a, chain[-2]] <= costs[a, b]:
+                b = chain[-2]
+            if len(chain) == 1 or b != chain[-2]:
+                chain.append(b)
+                continue
+            chain = chain[:-2]
+            merges.append((nodes[a], nodes[b], costs[a, b]))
+            # Lance-Williams update for the Ward criterion, merged into a
+            total = weights[a] + weights[b] + weights
+            updated = (
+                (weights[a] + weights) * costs[a]
+                + (weights[b] + weights) * costs[b]
+                - weights * costs[a, b]
+            ) / total
+            costs[a] = costs[:, a] = updated
+            costs[b] = costs[:, b] = np.inf
+            costs[a, a] = np.inf
+            weights[a] += weights[b]
+            active[b] = False
+            nodes[a] = n_samples + len(merges) - 1
+        children = np.array([m[:2] for m in merges], dtype=np.intp)
+        distances = np.array([m[2] for m in merges])
+        order = np.argsort(distances, kind='stable')
+        # renumber merged nodes to follow the sorted order
+        renumbered = np.arange(2 * n_samples - 1)
+        renumbered[n_samples + order] = n_samples + np.arange(len(order))
+        return (
+            renumbered[children[order]].reshape(-1, 2),
+            distances[order]
+        )
+
+
+def cut_tree(children: np.array, n_clusters: int) -> np.array:
+    """
+    Cuts merge tree into n_clusters clusters. Merges in children should be
+    sorted by distance, leaves are numbered 0..n_samples-1 and i-th merge
+    creates node n_samples+i (like in scipy.cluster.hierarchy linkage).
+    """
+    n_samples = len(children) + 1
+    parents = np.arange(2 * n_samples - 1)
+    for idx, (a, b) in enumerate(children[:max(0, n_samples - n_clusters)]):
+        parents[a] = parents[b] = n_samples + idx
+    # parents always have higher ids than their children
+    roots = parents.copy()
+    for node in range(len(parents) - 1, -1, -1):
+        roots[node] = roots[parents[node]]
+    return np.unique(roots[:n_samples], return_inverse=True)[1]
+
+
+class TwoStageClustering(BaseEstimator, ClusterMixin):
+    """
+    Scalable approximation of Ward clustering: data is first compressed
+    into n_micro_clusters micro-clusters (with MiniBatchKMeans or BIRCH),
+    then micro-cluster centroids are clustered with Ward linkage,
+    weighted by micro-cluster sizes, and labels are mapped back to samples.
+    """
+    def __init__(
+            self,
+            n_clusters: int = 2,
+            n_micro_clusters: int = 2000,
+            method: str = 'minibatch',
+            birch_threshold: float = 0.5,
+            random_state: int = 0
+    ):
+        self.n_clusters = n_clusters
+        self.n_micro_clusters = n_micro_clusters
+        self.method = method
+        self.birch_threshold = birch_threshold
+        self.random_state = random_state
+
+    def fit(self, X, y=None, sample_weight=None):
+        X = np.asarray(X)
+        if sample_weight is None:
+            sample_weight = np.ones(len(X))
+        if len(X) <= self.n_micro_clusters:
+            micro_labels = np.arange(len(X))
+        else:
+            micro_labels = self._micro_clusters(X)
+        # centroids are recomputed as (weighted) means of assigned samples
+        membership = csr_matrix((
+            sample_weight,
+            (micro_labels, np.arange(len(X)))
+        ))
+        micro_weights = np.asarray(membership.sum(axis=1)).ravel()
+        used = micro_weights > 0
+        centroids = membership[used] @ X / micro_weights[used, np.newaxis]
+        self.micro_labels_ = np.cumsum(used)[micro_labels] - 1
+        self.ward_ = WeightedWardClustering(
+            n_clusters=min(self.n_clusters, len(centroids))
+        ).fit(centroids, sample_weight=micro_weights[used])
+        self.labels_ = self.ward_.labels_[self.micro_labels_]
+        return self
+
+    def fit_predict(self, X, y=None, sample_weight=None):
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+    def _micro_clusters(self, X: np.array) -> np.array:
+        if self.method == 'minibatch':
+            return MiniBatchKMeans(
+                n_clusters=self.n_micro_clusters,
+                random_state=self.random_state
+            ).fit_predict(X)
+        if self.method == 'birch':
+            return Birch(
+                n_clusters=None,
+                threshold=self.birch_threshold
+            ).fit_predict(X)
+        raise ValueError(f"Unknown micro-clustering method: {self.method}")
@@ -1,28 +1,42 @@
+from contextlib import nullcontext
+from pathlib import Path
+import time
+
 from sklearn.base import BaseEstimator, ClusterMixin, TransformerMixin
-from sklearn.metrics import silhouette_score, calinski_harabaz_score
-import numpy as np
 
+from image_cluster.pipeline.assigner import Assigner
+from image_cluster.pipeline.dedup import Deduplicator
+from image_cluster.pipeline.metrics import evaluate
+from image_cluster.pipeline.trace import Tracer, instrument
 from image_cluster.pipeline.utils import VerboseMixin
 from image_cluster.pipeline.model_factory import ModelFactory
-from image_cluster.types import Score
 
 
 class Pipeline(BaseEstimator, ClusterMixin, VerboseMixin):
     """
     Wrapper for preprocessing pipeline, clustering model,
     metric calculation and postprocessing.
+    If tracer is given, every step (and model fit) is recorded as its span.
+    If preprocessing contains a deduplicator, the model is fitted
+    on group representatives weighted by group sizes (model has to accept
+    sample_weight), and labels of all images (labels_) are expanded
+    from labels of preprocessed rows (row_labels_, representatives).
     """
     def __init__(
             self,
             preprocessing: TransformerMixin,
             model_factory: ModelFactory,
             postprocessing: TransformerMixin,
-            verbose: bool = False
+            verbose: bool = False,
+            tracer: Tracer = None,
+            deduplicator: Deduplicator = None
     ):
         self.preprocessing = preprocessing
         self.model_factory = model_factory
         self.postprocessing = postprocessing
         self.verbose = verbose
+        self.tracer = tracer
+        self.deduplicator = deduplicator
 
     def fit(self, X):
         """
@@ -33,40 +47,92 @@ class Pipeline(BaseEstimator, ClusterMixin, VerboseMixin):
         scikt-learn estimators API.
         """
         self._log("Preprocessing...")
-        self.preprocessed_ = self.preprocessing.fit_transform(X)
+        self.preprocessed_ = self._traced(
+            self.preprocessing,
+            'preprocessing'
+        ).fit_transform(X)
         self._log("Creating model...")
         self.n_samples_ = len(self.preprocessed_)
-        self.model_ = self.model_factory(self.n_samples_)
+        if self.deduplicator is None:
+            n_images = self.n_samples_
+            fit_params = {}
+        else:
+            n_images = len(self.deduplicator.inverse_)
+            fit_params = dict(sample_weight=self.deduplicator.counts_)
+        self.model_ = self.model_factory(n_images)
         self._log("Fitting model...")
-        self.model_.fit(self.preprocessed_)
-        self.labels_ = self.model_.fit_predict(self.preprocessed_)
+        start = time.perf_counter()
+        with self._span('model', self.n_samples_):
+            self.row_labels_ = self.model_.fit_predict(
+                self.preprocessed_,
+                **fit_params
+            )
+        if self.deduplicator is None:
+            self.labels_ = self.row_labels_
+        else:
+            self.labels_ = self.deduplicator.expand(self.row_labels_)
+            self._log_deduplication(time.perf_counter() - start)
         self._log("Postprocessing...")
-        self.postprocessed_ = self.postprocessing.fit_transform(
-            self.labels_
-        )
+        self.postprocessed_ = self._traced(
+            self.postprocessing,
+            'postprocessing'
+        ).fit_transform(self.labels_)
         return self
 
-    def score(self):
+    def score(self, sample_size: int = None):
+        """
+        Calculates metrics of the fitted model. Silhouette score is
+        estimated from a sample stratified over clusters if sample_size
+        is given, otherwise it is computed exactly.
+        Deduplicated images are scored with features of their
+        representatives, so that scores are comparable with runs
+        without deduplication.
+        """
         self._log("Scoring...")
-        normal_labels = self.labels_[self.labels_ >= 0]
-        label_value_counts = np.bincount(normal_labels)
-        outliers = self.labels_[self.labels_ == -1]
-        self.score_ = Score(
-            silhouette_score=silhouette_score(
-                self.preprocessed_,
-                self.labels_
-            ),
-            calinski_harabaz_score=calinski_harabaz_score(
-                self.preprocessed_,
-                self.labels_
-            ),
-            n_samples=len(self.preprocessed_),
-            n_clusters=self.model_.n_clusters,
-            n_outliers=len(outliers),
-            label_size_min=np.min(label_value_counts),
-            label_size_max=np.max(label_value_counts),
-            label_size_mean=np.mean(label_value_counts),
-            label_size_var=np.var(label_value_counts)
-        )
+        X = self.preprocessed_
+        if self.deduplicator is not None:
+            X = X[self.deduplicator.inverse_]
+        with self._span('score', len(X)):
+            self.score_ = evaluate(
+                X,
+                self.labels_,
+                n_clusters=self.model_.n_clusters,
+                sample_size=sample_size
+            )
         self._log(self.score_)
         return self.score_
+
+    def save(self, path: Path):
+        """
+        Saves fitted artifact, used to assign new images to clusters.
+        """
+        self._log(f"Saving model to {path}...")
+        Assigner.from_pipeline(self).save(path)
+
+    def _log_deduplication(self, fit_time: float):
+        """
+        Reports removed rows and an estimate of model fit time saved
+        by deduplication, assuming fit time quadratic in the number
+        of rows (as for ward clustering), without fitting the full data.
+        """
+        n_images = len(self.deduplicator.inverse_)
+        n_removed = n_images - self.n_samples_
+        self.time_saved_ = fit_time * (
+            (n_images / max(1, self.n_samples_))**2 - 1
+        )
+        self._log(
+            f"Deduplication removed {n_removed} of {n_images} rows "
+            f"({100 * n_removed / max(1, n_images):.1f}%), model fitted "
+            f"in {fit_time:.2f}s, estimated {self.time_saved_:.2f}s saved "
+            f"(assuming quadratic fit time)"
+        )
+
+    def _traced(self, estimator: TransformerMixin, name: str):
+        if self.tracer is None:
+            return estimator
+        return instrument(estimator, self.tracer, name)
+
+    def _span(self, name: str, items: int = None):
+        if self.tracer is None:
+            return nullcontext()
+        return self.tracer.span(name, items)
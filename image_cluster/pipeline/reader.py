@@ -1,12 +1,33 @@
-from typing import Union, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Union, Iterable, Iterator, List, Tuple
 from pathlib import Path
+import os
 
 from sklearn.base import BaseEstimator, TransformerMixin
 import cv2 as cv
 import numpy as np
 
-from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
-from image_cluster.types import ImageData
+from image_cluster.pipeline.utils import (
+    NoFitMixin,
+    VerboseMixin,
+    effective_n_jobs
+)
+from image_cluster.types import BitMask, ImageData
+
+
+class ImageReadError(IOError):
+    """
+    Raised when images cannot be read, lists all failed paths.
+    """
+    def __init__(self, failures: List[Tuple[Path, str]]):
+        self.failures = failures
+        report = "\n".join(
+            f"\t{path}: {reason}" for path, reason in failures
+        )
+        super().__init__(
+            f"Failed to read {len(failures)} image(s):\n{report}"
+        )
 
 
 class MetadataReader(BaseEstimator, TransformerMixin, NoFitMixin):
@@ -15,8 +36,20 @@ class MetadataReader(BaseEstimator, TransformerMixin, NoFitMixin):
     Metadata path can be specified either
     during construction or during transform,
     for easier experimenting.
+    Metadata file is parsed lazily, chunk_size lines at a time.
+    If resolve_paths is set, directories are resolved once (instead of
+    once per image) and only symlinked images are resolved on their own,
+    otherwise paths are only made absolute.
     """
-    def __init__(self, meta_path: Union[str, Path] = None):
+    def __init__(
+            self,
+            meta_path: Union[str, Path] = None,
+            resolve_paths: bool = True,
+            chunk_size: int = 65536
+    ):
+        self.meta_path = meta_path
+        self.resolve_paths = resolve_paths
+        self.chunk_size = chunk_size
         self._store_meta(meta_path)
 
     def transform(
@@ -28,17 +61,43 @@ class MetadataReader(BaseEstimator, TransformerMixin, NoFitMixin):
 
     def _store_meta(self, meta_path: Union[str, Path]):
         if meta_path is not None:
-            with open(meta_path, 'r') as f:
-                self.metadata_ = list(
-                    map(self.parse_meta_line, f.readlines())
-                )
+            self.metadata_ = [
+                img for chunk in self.iter_meta(meta_path) for img in chunk
+            ]
+
+    def iter_meta(
+            self,
+            meta_path: Union[str, Path]
+    ) -> Iterator[List[ImageData]]:
+        """
+        Yields lists of (at most chunk_size) ImageData parsed from meta_path,
+        without reading the whole file into memory.
+        """
+        directories = {}
+        with open(meta_path, 'r') as f:
+            while True:
+                lines = list(islice(f, self.chunk_size))
+                if not lines:
+                    break
+                yield [
+                    self._parse(line, directories) for line in lines
+                    if line.strip()
+                ]
 
     def parse_meta_line(self, line: str) -> ImageData:
-        img_path = Path(line.strip())
-        return ImageData(
-            img_path.name,
-            img_path.resolve()
-        )
+        return self._parse(line, {})
+
+    def _parse(self, line: str, directories: Dict[str, Path]) -> ImageData:
+        img_dir, img_name = os.path.split(line.strip())
+        if img_dir not in directories:
+            if self.resolve_paths:
+                directories[img_dir] = Path(img_dir).resolve()
+            else:
+                directories[img_dir] = Path(os.path.abspath(img_dir))
+        img_path = directories[img_dir] / img_name
+        if self.resolve_paths and os.path.islink(img_path):
+            img_path = img_path.resolve()
+        return ImageData(img_name, img_path)
 
 
 class BaseImageReader(
@@ -49,20 +108,65 @@ class BaseImageReader(
 ):
     """
     Base class for all image readers.
+    Images can be decoded by a pool of n_threads threads
+    (OpenCV releases the GIL while decoding), order is preserved.
+    All images that fail to read are reported together,
+    in a single ImageReadError raised after reading.
     """
-    def __init__(self, verbose: bool = False):
+    def __init__(self, n_threads: int = None, verbose: bool = False):
+        self.n_threads = n_threads
         self.verbose = verbose
 
     def transform(
             self,
             image_data: Iterable[ImageData]
     ) -> Iterable[ImageData]:
-        self.images_ = [
-            self.strategy(img)
-            for img in self._progress(image_data)
+        image_data = list(image_data)
+        self._open()
+        n_threads = effective_n_jobs(self.n_threads)
+        if n_threads == 1:
+            results = list(self._progress(
+                map(self._read, image_data),
+                total=len(image_data)
+            ))
+        else:
+            with ThreadPoolExecutor(n_threads) as executor:
+                results = list(self._progress(
+                    executor.map(self._read, image_data),
+                    total=len(image_data)
+                ))
+        failures = [
+            failure
+            for _, error in results if error is not None
+            for failure in error.failures
         ]
+        if failures:
+            raise ImageReadError(failures)
+        self.images_ = [img for img, _ in results]
         return self.images_
 
+    def _open(self):
+        """
+        Prepares reading, called once before images are read
+        (also by readers wrapping this one).
+        """
+
+    def _read(self, image_data: ImageData):
+        try:
+            return self.strategy(image_data), None
+        except ImageReadError as error:
+            return None, error
+
+    def _imread(self, path: Path, flags: int) -> np.array:
+        img = cv.imread(str(path), flags)
+        if img is None:
+            if not Path(path).is_file():
+                reason = "file does not exist"
+            else:
+                reason = "file could not be decoded as an image"
+            raise ImageReadError([(path, reason)])
+        return img
+
     def strategy(self, image_data: ImageData) -> ImageData:
         raise NotImplementedError()
 
@@ -70,9 +174,19 @@ class BaseImageReader(
 class MaskImageReader(BaseImageReader):
     """
     Reads image to binary mask, 0 = white, 1 = black.
+    If packed, masks are stored as BitMask (8 pixels per byte).
     """
+    def __init__(
+            self,
+            packed: bool = False,
+            n_threads: int = None,
+            verbose: bool = False
+    ):
+        super().__init__(n_threads, verbose)
+        self.packed = packed
+
     def strategy(self, image_data):
-        img = cv.imread(str(image_data.path), cv.IMREAD_GRAYSCALE)
+        img = self._imread(image_data.path, cv.IMREAD_GRAYSCALE)
         _, img = cv.threshold(
             img,
             0,
@@ -80,6 +194,8 @@ class MaskImageReader(BaseImageReader):
             cv.THRESH_BINARY+cv.THRESH_OTSU
         )
         image_data.image = (1 - (img // 255)).astype(np.uint8)
+        if self.packed:
+            image_data.image = BitMask.from_mask(image_data.image)
         return image_data
 
 
@@ -87,7 +203,176 @@ class GreyscaleImageReader(BaseImageReader):
     """
     Reads image as greyscale, 0. = white, 1. = black.
     """
+    def __init__(
+            self,
+            dtype: type = np.float64,
+            n_threads: int = None,
+            verbose: bool = False
+    ):
+        super().__init__(n_threads, verbose)
+        self.dtype = dtype
+
+    def strategy(self, image_data):
+        img = self._imread(image_data.path, cv.IMREAD_GRAYSCALE)
+        image_data.image = 1 - img.astype(self.dtype) / 255
+        return image_data
+
+
+class RawImageReader(BaseImageReader):
+    """
+    Reads image as greyscale, without any conversion (uint8, 255 = white).
+    """
     def strategy(self, image_data):
-        img = cv.imread(str(image_data.path), cv.IMREAD_GRAYSCALE)
-        image_data.image = 1 - img.astype(np.float) / 255
+        image_data.image = self._imread(
+            image_data.path,
+            cv.IMREAD_GRAYSCALE
+        )
         return image_data
+
+
+class ImagePacker(
+        BaseEstimator,
+        TransformerMixin,
+        NoFitMixin,
+        VerboseMixin
+):
+    """
+    Decodes images once and packs them into a shard directory:
+    pixels.bin (contiguous uint8 buffer of all images, row-major)
+    and index.npz (offsets and shapes of images in the buffer,
+    their names and paths, and shard mode).
+    In greyscale mode raw greyscale pixels are stored,
+    in mask mode - binary masks (as read by MaskImageReader).
+    Images are decoded and written chunk_size at a time.
+    """
+    modes = ('greyscale', 'mask')
+
+    def __init__(
+            self,
+            shard_dir: Path,
+            mode: str = 'greyscale',
+            chunk_size: int = 1024,
+            n_threads: int = None,
+            verbose: bool = False
+    ):
+        self.shard_dir = shard_dir
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads
+        self.verbose = verbose
+
+    def transform(self, image_data: Iterable[ImageData]) -> Path:
+        if self.mode not in self.modes:
+            raise ValueError(f"Unknown shard mode: {self.mode}")
+        reader_class = RawImageReader if self.mode == 'greyscale' \
+            else MaskImageReader
+        reader = reader_class(n_threads=self.n_threads)
+        image_data = list(image_data)
+        shard_dir = Path(self.shard_dir)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        shapes = np.zeros((len(image_data), 2), dtype=np.int64)
+        with open(shard_dir / 'pixels.bin', 'wb') as f:
+            chunks = range(0, len(image_data), self.chunk_size)
+            for start in self._progress(chunks):
+                chunk = image_data[start:start+self.chunk_size]
+                for idx, img in enumerate(reader.transform(chunk), start):
+                    shapes[idx] = img.image.shape
+                    f.write(np.ascontiguousarray(img.image).tobytes())
+                    img.image = None
+        sizes = shapes[:, 0] * shapes[:, 1]
+        # typed explicitly, so that empty shards have the same index
+        np.savez(
+            shard_dir / 'index.npz',
+            offsets=np.cumsum(sizes, dtype=np.int64) - sizes,
+            shapes=shapes,
+            names=np.array([str(img.name) for img in image_data], dtype=str),
+            paths=np.array([str(img.path) for img in image_data], dtype=str),
+            mode=np.array(self.mode)
+        )
+        return shard_dir
+
+
+class PackedImageReader(BaseImageReader):
+    """
+    Reads images from a shard created by ImagePacker,
+    memory-mapping its pixel buffer instead of decoding image files.
+    Images are matched with the shard by path.
+    Greyscale shards are read like GreyscaleImageReader does,
+    mask shards like MaskImageReader, as views of the buffer (no copy).
+    """
+    def __init__(
+            self,
+            shard_dir: Path,
+            dtype: type = np.float64,
+            n_threads: int = None,
+            verbose: bool = False
+    ):
+        super().__init__(n_threads, verbose)
+        self.shard_dir = shard_dir
+        self.dtype = dtype
+
+    def _open(self):
+        shard_dir = Path(self.shard_dir)
+        with np.load(shard_dir / 'index.npz') as index:
+            self.offsets_ = index['offsets']
+            self.shapes_ = index['shapes']
+            self.mode_ = str(index['mode'])
+            self.rows_ = {
+                path: row for row, path in enumerate(index['paths'])
+            }
+        if np.sum(self.shapes_[:, 0] * self.shapes_[:, 1]) == 0:
+            # empty files can't be memory-mapped
+            self.pixels_ = np.zeros(0, dtype=np.uint8)
+        else:
+            self.pixels_ = np.memmap(
+                shard_dir / 'pixels.bin',
+                dtype=np.uint8,
+                mode='r'
+            )
+
+    def strategy(self, image_data):
+        row = self.rows_.get(str(image_data.path))
+        if row is None:
+            raise ImageReadError([(image_data.path, "image is not in shard")])
+        height, width = self.shapes_[row]
+        offset = self.offsets_[row]
+        img = self.pixels_[offset:offset+height*width].reshape(height, width)
+        if self.mode_ == 'mask':
+            image_data.image = img
+        else:
+            image_data.image = 1 - img.astype(self.dtype) / 255
+        return image_data
+
+    def decoding_reader(self) -> BaseImageReader:
+        """
+        Reader decoding image files like this reader reads the shard
+        (for images that are not in it).
+        """
+        with np.load(Path(self.shard_dir) / 'index.npz') as index:
+            mode = str(index['mode'])
+        if mode == 'mask':
+            return MaskImageReader(
+                n_threads=self.n_threads,
+                verbose=self.verbose
+            )
+        return GreyscaleImageReader(
+            dtype=self.dtype,
+            n_threads=self.n_threads,
+            verbose=self.verbose
+        )
+
+
+class ImageReleaser(BaseEstimator, TransformerMixin, NoFitMixin):
+    """
+    Passes features through unchanged, releasing pixel data
+    of images read by image_reader (used once features are computed).
+    Lowers memory used after the feature step, not its peak
+    (StreamingFeatureExtractor keeps only a few chunks of pixels).
+    """
+    def __init__(self, image_reader: BaseImageReader):
+        self.image_reader = image_reader
+
+    def transform(self, X):
+        for image_data in self.image_reader.images_:
+            image_data.image = None
+        return X
@@ -0,0 +1,318 @@
+from functools import partial
+from itertools import product
+from multiprocessing import Pool
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from image_cluster.pipeline.metrics import evaluate
+from image_cluster.pipeline.reader import (
+    GreyscaleImageReader,
+    MaskImageReader,
+    MetadataReader
+)
+from image_cluster.pipeline.utils import VerboseMixin, effective_n_jobs
+from image_cluster.pipeline.vectorizer import (
+    FilterImageVectorizer,
+    IOUImageVectorizer,
+    ShapeVectorizer,
+    TextDensityVectorizer
+)
+from image_cluster.types import ImageData, Score
+
+
+Config = Dict[str, object]
+
+# values of parameters missing from the grid
+DEFAULT_CONFIG = dict(
+    reader='greyscale',
+    vectorizer='iou',
+    filter_shape=(3, 3),
+    features=('shape', 'density'),
+    scaler='minmax',
+    reducer='none',
+    n_components=64,
+    model='ward',
+    n_clusters=60,
+    eps=0.5,
+    min_samples=5
+)
+# parameters that determine features (computed once for every combination)
+UPSTREAM_PARAMS = ('reader', 'vectorizer', 'filter_shape', 'features')
+
+READERS = {
+    'greyscale': GreyscaleImageReader,
+    'mask': MaskImageReader,
+    'packed-mask': partial(MaskImageReader, packed=True),
+}
+VECTORIZERS = {
+    'iou': IOUImageVectorizer,
+    'filter': FilterImageVectorizer,
+}
+FEATURES = {
+    'shape': ShapeVectorizer,
+    'density': TextDensityVectorizer,
+}
+SCALERS = ('minmax', 'standard', 'none')
+REDUCERS = ('none', 'pca', 'incremental-pca', 'random-projection')
+MODELS = ('ward', 'average', 'complete', 'kmeans', 'two-stage', 'dbscan')
+
+
+class Search(VerboseMixin):
+    """
+    Evaluates every configuration of the grid (dict of parameter lists,
+    or a list of such dicts): reader, vectorizer, filter_shape,
+    extra features, scaler, reducer (with n_components), model
+    (with n_clusters or DBSCAN eps and min_samples).
+    Images are read once per reader and vectorized once per distinct
+    combination of reader, vectorizer and filter shape, then scaling,
+    reduction, clustering and scoring of all configurations are spread
+    over n_jobs processes. Results are ranked by silhouette score.
+    """
+    def __init__(
+            self,
+            grid: Union[Dict[str, list], List[Dict[str, list]]],
+            sample_size: int = None,
+            n_jobs: int = None,
+            read_threads: int = None,
+            verbose: bool = False
+    ):
+        self.grid = grid
+        self.sample_size = sample_size
+        self.n_jobs = n_jobs
+        self.read_threads = read_threads
+        self.verbose = verbose
+
+    def fit(self, X):
+        self.configs_ = expand_grid(self.grid)
+        self._log(f"{len(self.configs_)} configurations")
+        image_data = MetadataReader().transform(X)
+        features = self._features(image_data)
+        tasks = [
+            (idx, _upstream_key(config), config, self.sample_size)
+            for idx, config in enumerate(self.configs_)
+        ]
+        self._log("Clustering and scoring...")
+        n_jobs = min(effective_n_jobs(self.n_jobs), len(tasks))
+        if n_jobs <= 1:
+            _init_worker(features)
+            results = list(self._progress(map(_evaluate, tasks)))
+        else:
+            # features are sent to every worker once, on startup
+            with Pool(
+                    n_jobs,
+                    initializer=_init_worker,
+                    initargs=(features,)
+            ) as pool:
+                results = list(self._progress(
+                    pool.imap_unordered(_evaluate, tasks),
+                    total=len(tasks)
+                ))
+        results = sorted(results)
+        self.scores_ = [score for _, score, _ in results]
+        self.errors_ = [error for _, _, error in results]
+        self.ranking_ = sorted(
+            range(len(self.configs_)),
+            key=lambda idx: (
+                self.scores_[idx] is None,
+                -self.scores_[idx].silhouette_score
+                if self.scores_[idx] is not None else 0
+            )
+        )
+        return self
+
+    def results(self) -> List[Tuple[Config, Score, str]]:
+        """
+        Ranked (configuration, score, error) triples,
+        failed configurations (without score) are last.
+        """
+        return [
+            (self.configs_[idx], self.scores_[idx], self.errors_[idx])
+            for idx in self.ranking_
+        ]
+
+    def _features(
+            self,
+            image_data: List[ImageData]
+    ) -> Dict[tuple, Union[np.array, Exception]]:
+        """
+        Computes features of every distinct upstream configuration
+        (or the error of their vectorizer),
+        reading images with every reader once.
+        """
+        keys = sorted({_upstream_key(config) for config in self.configs_})
+        features = {}
+        for reader in sorted({key[0] for key in keys}):
+            self._log(f"Reading images ({reader})...")
+            images = READERS[reader](
+                n_threads=self.read_threads,
+                verbose=self.verbose
+            ).transform([ImageData(img.name, img.path) for img in image_data])
+            reader_keys = [key for key in keys if key[0] == reader]
+            extra = {
+                name: FEATURES[name](n_jobs=self.n_jobs).transform(images)
+                for name in sorted({
+                    name for key in reader_keys for name in key[3]
+                })
+            }
+            vectors = {}
+            for key in reader_keys:
+                _, vectorizer, filter_shape, extra_names = key
+                if (vectorizer, filter_shape) not in vectors:
+                    self._log(f"Vectorizing ({vectorizer} {filter_shape})...")
+                    vectors[vectorizer, filter_shape] = self._vectorize(
+                        vectorizer,
+                        filter_shape,
+                        images
+                    )
+                key_vectors = vectors[vectorizer, filter_shape]
+                if isinstance(key_vectors, Exception):
+                    features[key] = key_vectors
+                    continue
+                features[key] = np.hstack(
+                    [key_vectors] + [extra[name] for name in extra_names]
+                ).astype(np.float64)
+            for img in images:
+                img.image = None
+        return features
+
+    def _vectorize(
+            self,
+            vectorizer: str,
+            filter_shape: Tuple[int, int],
+            images: List[ImageData]
+    ) -> Union[np.array, Exception]:
+        """
+        Vectorizes images, returning the error instead of raising it
+        (e.g. filter bank too large), so that only configurations
+        with these features fail.
+        """
+        try:
+            return VECTORIZERS[vectorizer](
+                filter_shape,
+                n_jobs=self.n_jobs,
+                verbose=self.verbose
+            ).transform(images)
+        except Exception as error:
+            return error
+
+
+def expand_grid(
+        grid: Union[Dict[str, list], List[Dict[str, list]]]
+) -> List[Config]:
+    """
+    Lists all configurations of the grid (or list of grids),
+    filling missing parameters with DEFAULT_CONFIG values.
+    """
+    if isinstance(grid, dict):
+        grid = [grid]
+    configs = []
+    for subgrid in grid:
+        unknown = set(subgrid) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+        for name, choices in _CHOICES.items():
+            for value in subgrid.get(name, ()):
+                values = value if name == 'features' else [value]
+                if not set(values) <= set(choices):
+                    raise ValueError(f"Unknown {name}: {value}")
+        names = list(subgrid)
+        for values in product(*(subgrid[name] for name in names)):
+            config = dict(DEFAULT_CONFIG)
+            config.update(zip(names, values))
+            config['filter_shape'] = tuple(config['filter_shape'])
+            config['features'] = tuple(config['features'])
+            configs.append(config)
+    return configs
+
+
+_CHOICES = dict(
+    reader=READERS,
+    vectorizer=VECTORIZERS,
+    features=FEATURES,
+    scaler=SCALERS,
+    reducer=REDUCERS,
+    model=MODELS
+)
+
+
+def _upstream_key(config: Config) -> tuple:
+    return tuple(config[name] for name in UPSTREAM_PARAMS)
+
+
+# scikit-learn estimators are imported when a configuration is evaluated
+def _scaler(name: str):
+    if name == 'minmax':
+        from sklearn.preprocessing import MinMaxScaler
+        return MinMaxScaler()
+    if name == 'standard':
+        from sklearn.preprocessing import StandardScaler
+        return StandardScaler()
+    return None
+
+
+def _reducer(name: str, n_components: int):
+    if name == 'pca':
+        from sklearn.decomposition import PCA
+        return PCA(n_components=n_components, random_state=0)
+    if name == 'incremental-pca':
+        from sklearn.decomposition import IncrementalPCA
+        return IncrementalPCA(n_components=n_components)
+    if name == 'random-projection':
+        from sklearn.random_projection import SparseRandomProjection
+        return SparseRandomProjection(
+            n_components=n_components,
+            dense_output=True,
+            random_state=0
+        )
+    return None
+
+
+def _model(c: Config):
+    name = c['model']
+    if name in ('ward', 'average', 'complete'):
+        from sklearn.cluster import AgglomerativeClustering
+        return AgglomerativeClustering(c['n_clusters'], linkage=name)
+    if name == 'kmeans':
+        from sklearn.cluster import KMeans
+        return KMeans(c['n_clusters'], random_state=0)
+    if name == 'two-stage':
+        from image_cluster.pipeline.model import TwoStageClustering
+        return TwoStageClustering(c['n_clusters'])
+    from sklearn.cluster import DBSCAN
+    return DBSCAN(eps=c['eps'], min_samples=c['min_samples'])
+
+
+_worker_features = None
+
+
+def _init_worker(features: Dict[tuple, Union[np.array, Exception]]):
+    global _worker_features
+    _worker_features = features
+
+
+def _evaluate(task) -> Tuple[int, Score, str]:
+    """
+    Scales, reduces and clusters shared features of the configuration,
+    returns its index, score and error (if the configuration failed).
+    """
+    idx, key, config, sample_size = task
+    try:
+        X = _worker_features[key]
+        if isinstance(X, Exception):
+            raise X
+        scaler = _scaler(config['scaler'])
+        if scaler is not None:
+            X = scaler.fit_transform(X)
+        reducer = _reducer(
+            config['reducer'],
+            min(config['n_components'], *X.shape)
+        )
+        if reducer is not None:
+            X = reducer.fit_transform(X)
+        labels = _model(config).fit_predict(X)
+        n_clusters = None if config['model'] == 'dbscan' \
+            else config['n_clusters']
+        return idx, evaluate(X, labels, n_clusters, sample_size), None
+    except Exception as error:
+        return idx, None, repr(error)
@@ -0,0 +1,138 @@
+from pathlib import Path
+from typing import Iterable
+
+from sklearn.base import BaseEstimator, TransformerMixin
+import numpy as np
+
+from image_cluster.pipeline.cache import config_key
+from image_cluster.pipeline.reader import BaseImageReader
+from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
+from image_cluster.pipeline.vectorizer import BaseImageVectorizer
+from image_cluster.types import ImageData
+
+
+class ShardVectorizer(
+        BaseEstimator,
+        TransformerMixin,
+        NoFitMixin,
+        VerboseMixin
+):
+    """
+    Reads and vectorizes shard number shard (out of n_shards) of images,
+    saving a feature shard to output_file: row indices, names, paths
+    and raw (unscaled) features of images in the shard, along with
+    the feature configuration key. Shards are contiguous and consist
+    of whole vectorizer chunks, so that features are computed exactly
+    as in a single process.
+    """
+    def __init__(
+            self,
+            image_reader: BaseImageReader,
+            vectorizer: BaseImageVectorizer,
+            output_file: Path,
+            shard: int = 0,
+            n_shards: int = 1,
+            verbose: bool = False
+    ):
+        self.image_reader = image_reader
+        self.vectorizer = vectorizer
+        self.output_file = output_file
+        self.shard = shard
+        self.n_shards = n_shards
+        self.verbose = verbose
+
+    def transform(self, image_data: Iterable[ImageData]) -> np.array:
+        if not 0 <= self.shard < self.n_shards:
+            raise ValueError(f"Invalid shard: {self.shard}/{self.n_shards}")
+        image_data = list(image_data)
+        self.rows_ = shard_rows(
+            len(image_data),
+            self.shard,
+            self.n_shards,
+            self.vectorizer.chunk_size
+        )
+        self._log(
+            f"Shard {self.shard}/{self.n_shards}: "
+            f"{len(self.rows_)} of {len(image_data)} images"
+        )
+        self.images_ = [image_data[idx] for idx in self.rows_]
+        images = self.image_reader.fit_transform(self.images_)
+        self.features_ = self.vectorizer.fit_transform(images)
+        np.savez(
+            self.output_file,
+            rows=self.rows_,
+            n_rows=len(image_data),
+            names=np.array([img.name for img in self.images_], dtype=str),
+            paths=np.array([img.path for img in self.images_], dtype=str),
+            features=self.features_,
+            config=config_key([self.image_reader, self.vectorizer])
+        )
+        return self.features_
+
+
+class FeatureShardReader(
+        BaseEstimator,
+        TransformerMixin,
+        NoFitMixin
+):
+    """
+    Merges feature shards saved by ShardVectorizer into a single matrix,
+    in the original order of images. Shards must have the same feature
+    configuration and cover every image exactly once.
+    Exposes images_ like image readers do.
+    """
+    def transform(self, shard_paths: Iterable[Path]) -> np.array:
+        shards = []
+        for path in shard_paths:
+            with np.load(path) as shard:
+                shards.append({key: shard[key] for key in shard.files})
+        if not shards:
+            raise ValueError("No feature shards given")
+        configs = {str(shard['config']) for shard in shards}
+        if len(configs) > 1:
+            raise ValueError(
+                "Feature shards were computed with different configurations"
+            )
+        n_rows = int(shards[0]['n_rows'])
+        rows = np.concatenate([shard['rows'] for shard in shards])
+        counts = np.bincount(rows, minlength=n_rows)
+        if len(counts) != n_rows or np.any(counts != 1) or any(
+                int(shard['n_rows']) != n_rows for shard in shards
+        ):
+            raise ValueError(
+                "Feature shards don't cover every image exactly once"
+            )
+        order = np.argsort(rows)
+        names, paths = (
+            np.concatenate([shard[key] for shard in shards])[order]
+            for key in ('names', 'paths')
+        )
+        self.images_ = [
+            ImageData(str(name), Path(path))
+            for name, path in zip(names, paths)
+        ]
+        self.features_ = np.concatenate(
+            [shard['features'] for shard in shards]
+        )[order]
+        return self.features_
+
+
+def shard_rows(
+        n_rows: int,
+        shard: int,
+        n_shards: int,
+        chunk_size: int = 1
+) -> np.array:
+    """
+    Indices of rows in the shard: chunks of chunk_size rows
+    are split evenly (and in order) between n_shards shards.
+    """
+    n_chunks = (n_rows + chunk_size - 1) // chunk_size
+    chunks = np.array_split(np.arange(n_chunks), n_shards)[shard]
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.arange(
+        chunks[0] * chunk_size,
+        min(n_rows, (chunks[-1] + 1) * chunk_size),
+        dtype=np.int64
+    )
@@ -0,0 +1,203 @@
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from typing import Iterable, List
+
+from sklearn.base import BaseEstimator, TransformerMixin
+import numpy as np
+
+from image_cluster.pipeline.reader import BaseImageReader, ImageReadError
+from image_cluster.pipeline.utils import (
+    NoFitMixin,
+    VerboseMixin,
+    effective_n_jobs,
+    _init_worker,
+    _transform_chunk_in_worker
+)
+from image_cluster.pipeline.vectorizer import BaseImageVectorizer
+from image_cluster.types import ImageData
+
+
+class StreamingFeatureExtractor(
+        BaseEstimator,
+        TransformerMixin,
+        NoFitMixin,
+        VerboseMixin
+):
+    """
+    Wraps image reader and vectorizer, overlapping image decoding
+    with vectorization: a producer thread decodes chunks of images
+    (with image_reader.n_threads threads) into a queue of at most
+    max_queued_chunks chunks, consumed by vectorizer.n_jobs processes.
+    Feature rows are written into a preallocated matrix, and pixels
+    are released as soon as their chunk is vectorized, so at most
+    (max_queued_chunks + 2 * n_jobs + 1) chunks of decoded images
+    are held in memory. Chunks have vectorizer.chunk_size images,
+    and features are identical to reading and vectorizing in sequence.
+    If vectorization fails, the producer is stopped and its queue drained.
+    Exposes images_ like image readers do.
+    """
+    def __init__(
+            self,
+            image_reader: BaseImageReader,
+            vectorizer: BaseImageVectorizer,
+            max_queued_chunks: int = 4,
+            verbose: bool = False
+    ):
+        self.image_reader = image_reader
+        self.vectorizer = vectorizer
+        self.max_queued_chunks = max_queued_chunks
+        self.verbose = verbose
+
+    def transform(self, image_data: Iterable[ImageData]) -> np.array:
+        self.images_ = list(image_data)
+        self.image_reader._open()
+        chunk_size = self.vectorizer.chunk_size
+        starts = range(0, len(self.images_), chunk_size)
+        n_jobs = min(effective_n_jobs(self.vectorizer.n_jobs), len(starts))
+        queue = Queue(maxsize=max(1, self.max_queued_chunks))
+        stop = Event()
+        failures = []
+        producer = Thread(
+            target=self._produce,
+            args=(queue, stop, starts, chunk_size, failures),
+            daemon=True
+        )
+        self.features_ = None
+        # worker processes are started before the producer thread,
+        # so that they are not forked while it is running
+        with _pool(n_jobs, self.vectorizer) as pool:
+            producer.start()
+            try:
+                self._consume(queue, pool, n_jobs, len(starts), chunk_size)
+            finally:
+                stop.set()
+                # unblocks the producer and releases queued chunks
+                _drain(queue)
+                producer.join()
+        if failures:
+            raise ImageReadError(failures)
+        if self.features_ is None:
+            self.features_ = np.zeros((len(self.images_), 0))
+        return self.features_
+
+    def _consume(
+            self,
+            queue: Queue,
+            pool: Pool,
+            n_jobs: int,
+            n_chunks: int,
+            chunk_size: int
+    ):
+        """
+        Vectorizes chunks from the queue, in the pool (if any)
+        with at most 2 * n_jobs chunks pending.
+        """
+        pending = deque()
+        chunks = self._progress_chunks(
+            (self._next_chunk(queue) for _ in range(n_chunks)),
+            total=len(self.images_),
+            size=lambda chunk: min(chunk_size, len(self.images_) - chunk[0])
+        )
+        for start, images in chunks:
+            if not images:
+                continue
+            if pool is None:
+                self._store(
+                    start,
+                    images,
+                    self.vectorizer._transform_chunk(images)
+                )
+                continue
+            pending.append((start, images, pool.apply_async(
+                _transform_chunk_in_worker,
+                (images,)
+            )))
+            if len(pending) >= 2 * n_jobs:
+                self._store_result(*pending.popleft())
+        while pending:
+            self._store_result(*pending.popleft())
+
+    def _produce(
+            self,
+            queue: Queue,
+            stop: Event,
+            starts: Iterable[int],
+            chunk_size: int,
+            failures: List
+    ):
+        """
+        Decodes chunks of images in order, blocking while the queue is full,
+        until all chunks are decoded or stop is set.
+        Chunks with images that failed to read are passed empty
+        (failures are reported after all images are read).
+        """
+        try:
+            n_threads = effective_n_jobs(self.image_reader.n_threads)
+            with ThreadPoolExecutor(n_threads) as executor:
+                for start in starts:
+                    if stop.is_set():
+                        return
+                    results = list(executor.map(
+                        self.image_reader._read,
+                        self.images_[start:start+chunk_size]
+                    ))
+                    errors = [
+                        error for _, error in results if error is not None
+                    ]
+                    for error in errors:
+                        failures.extend(error.failures)
+                    images = [] if errors else [img for img, _ in results]
+                    _put(queue, stop, (start, images))
+        except Exception as error:
+            _put(queue, stop, error)
+
+    def _next_chunk(self, queue: Queue):
+        item = queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def _store_result(self, start: int, images: List[ImageData], result):
+        self._store(start, images, result.get())
+
+    def _store(self, start: int, images: List[ImageData], vectors):
+        vectors = np.asarray(list(vectors))
+        if self.features_ is None:
+            self.features_ = np.zeros(
+                (len(self.images_),) + vectors.shape[1:],
+                dtype=vectors.dtype
+            )
+        self.features_[start:start+len(images)] = vectors
+        for img in images:
+            img.image = None
+
+
+def _put(queue: Queue, stop: Event, item, timeout: float = 0.1):
+    """
+    Puts item into the queue, blocking while it is full
+    unless stop is set (then the item is dropped).
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=timeout)
+            return
+        except Full:
+            pass
+
+
+def _drain(queue: Queue):
+    while True:
+        try:
+            queue.get_nowait()
+        except Empty:
+            return
+
+
+def _pool(n_jobs: int, vectorizer: BaseImageVectorizer):
+    if n_jobs <= 1:
+        return nullcontext()
+    return Pool(n_jobs, initializer=_init_worker, initargs=(vectorizer,))
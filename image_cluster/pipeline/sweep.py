@@ -0,0 +1,84 @@
+from typing import Iterable, List
+
+from sklearn.base import TransformerMixin
+from scipy.cluster.hierarchy import ward
+import numpy as np
+
+from image_cluster.pipeline.metrics import cluster_statistics, silhouette_sweep
+from image_cluster.pipeline.model import cut_tree
+from image_cluster.pipeline.utils import VerboseMixin
+from image_cluster.types import Score
+
+
+class Sweep(VerboseMixin):
+    """
+    Evaluates ward clustering for many numbers of clusters:
+    the full merge tree is built once and cut at every n_clusters value.
+    Silhouette scores of all cuts are computed in a single pass
+    over (optionally sampled) distance matrix rows.
+    """
+    def __init__(
+            self,
+            preprocessing: TransformerMixin,
+            n_clusters: Iterable[int],
+            sample_size: int = None,
+            verbose: bool = False
+    ):
+        self.preprocessing = preprocessing
+        self.n_clusters = n_clusters
+        self.sample_size = sample_size
+        self.verbose = verbose
+
+    def fit(self, X):
+        self._log("Preprocessing...")
+        self.preprocessed_ = self.preprocessing.fit_transform(X)
+        n_samples = len(self.preprocessed_)
+        self.n_clusters_ = [k for k in self.n_clusters if 2 <= k < n_samples]
+        if not self.n_clusters_:
+            raise ValueError(
+                f"No valid number of clusters for {n_samples} samples, "
+                f"expected values in range [2, {n_samples - 1}]"
+            )
+        self._log("Building merge tree...")
+        self.children_ = ward(self.preprocessed_)[:, :2].astype(np.intp)
+        self.labels_ = [
+            cut_tree(self.children_, k)
+            for k in self._progress(self.n_clusters_)
+        ]
+        return self
+
+    def score(self) -> List[Score]:
+        self._log("Scoring...")
+        silhouettes = silhouette_sweep(
+            self.preprocessed_,
+            self.labels_,
+            self.sample_size
+        )
+        self.scores_ = []
+        for k, labels, silhouette in zip(
+                self.n_clusters_,
+                self.labels_,
+                silhouettes
+        ):
+            calinski_harabaz, _, label_counts = cluster_statistics(
+                self.preprocessed_,
+                labels
+            )
+            self.scores_.append(Score(
+                silhouette_score=silhouette.score,
+                calinski_harabaz_score=calinski_harabaz,
+                n_samples=len(self.preprocessed_),
+                n_clusters=k,
+                n_outliers=0,
+                label_size_min=np.min(label_counts),
+                label_size_max=np.max(label_counts),
+                label_size_mean=np.mean(label_counts),
+                label_size_var=np.var(label_counts),
+                silhouette_method=silhouette.method,
+                silhouette_ci_low=silhouette.ci_low,
+                silhouette_ci_high=silhouette.ci_high
+            ))
+        best = np.argmax([score.silhouette_score for score in self.scores_])
+        self.recommended_ = self.n_clusters_[best]
+        self._log(f"Recommended number of clusters: {self.recommended_}")
+        return self.scores_
@@ -0,0 +1,173 @@
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Event, Thread, get_ident
+from time import perf_counter
+from typing import Dict, List
+import json
+import os
+import resource
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline as SklearnPipeline, FeatureUnion
+
+
+class Tracer(object):
+    """
+    Records spans of pipeline execution: wall time, CPU time
+    (including finished worker processes), items per second and peak RSS.
+    Peak RSS is sampled by a background thread while any span is open.
+    Spans are exported as Chrome trace (Perfetto) and plain metrics json.
+    """
+    def __init__(self, sampling_interval: float = 0.005):
+        self.sampling_interval = sampling_interval
+        self.spans = []
+        self._open_spans = []
+        self._origin = perf_counter()
+        self._stop_sampling = None
+
+    @contextmanager
+    def span(self, name: str, items: int = None):
+        record = {
+            'name': name,
+            'start': perf_counter() - self._origin,
+            'thread': get_ident(),
+            'peak_rss_mb': _current_rss_mb(),
+        }
+        cpu_start = _cpu_time()
+        self._open_spans.append(record)
+        if self._stop_sampling is None:
+            self._start_sampling()
+        try:
+            yield record
+        finally:
+            self._open_spans.remove(record)
+            if not self._open_spans:
+                self._stop_sampling.set()
+                self._stop_sampling = None
+            record['wall_time'] = (
+                perf_counter() - self._origin - record['start']
+            )
+            record['cpu_time'] = _cpu_time() - cpu_start
+            items = record.get('items', items)
+            record['items'] = items
+            record['items_per_second'] = (
+                items / record['wall_time']
+                if items is not None and record['wall_time'] > 0 else None
+            )
+            self.spans.append(record)
+
+    def save(self, trace_path: Path, metrics_path: Path = None):
+        with open(trace_path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        if metrics_path is not None:
+            with open(metrics_path, 'w') as f:
+                json.dump(self.spans, f, indent=2)
+
+    def chrome_trace(self) -> Dict[str, List[Dict]]:
+        pid = os.getpid()
+        return {'traceEvents': [
+            {
+                'name': span['name'],
+                'cat': 'pipeline',
+                'ph': 'X',
+                'ts': span['start'] * 1e6,
+                'dur': span['wall_time'] * 1e6,
+                'pid': pid,
+                'tid': span['thread'],
+                'args': {
+                    key: span[key] for key in (
+                        'cpu_time',
+                        'items',
+                        'items_per_second',
+                        'peak_rss_mb'
+                    )
+                },
+            }
+            for span in sorted(self.spans, key=lambda span: span['start'])
+        ]}
+
+    def _start_sampling(self):
+        stop = self._stop_sampling = Event()
+
+        def sample():
+            while not stop.wait(self.sampling_interval):
+                rss = _current_rss_mb()
+                for record in list(self._open_spans):
+                    record['peak_rss_mb'] = max(record['peak_rss_mb'], rss)
+
+        Thread(target=sample, daemon=True).start()
+
+
+class TracedStep(BaseEstimator, TransformerMixin):
+    """
+    Wraps transformer, recording fit and transform calls as tracer spans.
+    """
+    def __init__(self, estimator: TransformerMixin, tracer: Tracer, name: str):
+        self.estimator = estimator
+        self.tracer = tracer
+        self.name = name
+
+    def fit(self, X, y=None, **fit_params):
+        with self.tracer.span(f"{self.name}.fit", _length(X)):
+            self.estimator.fit(X, y, **fit_params)
+        return self
+
+    def transform(self, X):
+        with self.tracer.span(self.name, _length(X)) as record:
+            result = self.estimator.transform(X)
+            record['items'] = _length(X) or _length(result)
+        return result
+
+    def fit_transform(self, X, y=None, **fit_params):
+        with self.tracer.span(self.name, _length(X)) as record:
+            result = self.estimator.fit_transform(X, y, **fit_params)
+            record['items'] = _length(X) or _length(result)
+        return result
+
+
+def instrument(estimator, tracer: Tracer, name: str):
+    """
+    Returns traced version of estimator, sharing its steps (so fitted
+    state ends up in original objects). Steps of pipelines and
+    transformers of feature unions are traced separately.
+    """
+    if estimator is None:
+        return None
+    if isinstance(estimator, SklearnPipeline):
+        estimator = SklearnPipeline([
+            (step_name, instrument(step, tracer, f"{name}.{step_name}"))
+            for step_name, step in estimator.steps
+        ])
+    elif isinstance(estimator, FeatureUnion):
+        estimator = FeatureUnion(
+            [
+                (step_name, instrument(step, tracer, f"{name}.{step_name}"))
+                for step_name, step in estimator.transformer_list
+            ],
+            n_jobs=estimator.n_jobs,
+            transformer_weights=estimator.transformer_weights
+        )
+    return TracedStep(estimator, tracer, name)
+
+
+def _length(X) -> int:
+    try:
+        return len(X)
+    except TypeError:
+        return None
+
+
+def _cpu_time() -> float:
+    times = os.times()
+    return times.user + times.system + times.children_user \
+        + times.children_system
+
+
+def _current_rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2**20
+    except OSError:
+        # peak of the whole process, on systems without procfs (kB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
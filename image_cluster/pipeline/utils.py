@@ -1,15 +1,36 @@
+from contextlib import contextmanager
+from multiprocessing import Pool
+from typing import Callable, Iterable, Iterator, List, Tuple
 import math
+import os
 
 from tqdm import tqdm
 
 
 class VerboseMixin(object):
-    def _progress(self, iterator):
+    def _progress(self, iterator, total: int = None):
         if self.verbose:
-            return tqdm(iterator, desc=self.__class__.__name__)
+            return tqdm(iterator, desc=self.__class__.__name__, total=total)
         else:
             return iterator
 
+    def _progress_chunks(
+            self,
+            chunks: Iterable,
+            total: int = None,
+            size: Callable = len
+    ):
+        """
+        Like _progress, advancing by size of every chunk.
+        """
+        if not self.verbose:
+            yield from chunks
+            return
+        with tqdm(desc=self.__class__.__name__, total=total) as bar:
+            for chunk in chunks:
+                yield chunk
+                bar.update(size(chunk))
+
     def _log(self, message):
         if self.verbose:
             print(f"[{self.__class__.__name__}] {message}")
@@ -20,6 +41,134 @@ class NoFitMixin(object):
         return self
 
 
+class ParallelMixin(object):
+    """
+    Splits items into chunks of chunk_size and processes them with
+    _transform_chunk in a pool of n_jobs processes. With a single job,
+    items are processed in batches given by _transform_batches
+    (so that vectorizers batch as many images as their own memory
+    bounds allow), and progress is reported after every batch.
+    """
+    chunk_size = 32
+
+    def _transform_chunk(self, chunk: List) -> Iterable:
+        raise NotImplementedError()
+
+    def _transform_batches(
+            self,
+            items: List
+    ) -> Iterator[Tuple[List[int], Iterable]]:
+        """
+        Yields indices of batches of items together with their results,
+        batches may come in any order. Items are transformed one by one
+        unless overridden.
+        """
+        for idx, item in enumerate(items):
+            yield [idx], self._transform_chunk([item])
+
+    @contextmanager
+    def worker_pool(self):
+        """
+        Keeps a pool of n_jobs processes for all transforms inside
+        the context (e.g. in long running servers), instead of starting
+        a pool for every transform. Parameters must not change meanwhile,
+        as workers are started with a copy of the estimator.
+        """
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs == 1:
+            yield None
+            return
+        with Pool(
+                n_jobs,
+                initializer=_init_worker,
+                initargs=(self,)
+        ) as pool:
+            self._pool = pool
+            try:
+                yield pool
+            finally:
+                del self._pool
+
+    def _map_items(self, items: List) -> List:
+        """
+        Returns results of all items, in input order.
+        """
+        results = [None] * len(items)
+        for batch, batch_results in self._progress_chunks(
+                self._map_batches(items),
+                total=len(items),
+                size=lambda batch: len(batch[0])
+        ):
+            for idx, result in zip(batch, batch_results):
+                results[idx] = result
+        return results
+
+    def _map_batches(
+            self,
+            items: List
+    ) -> Iterator[Tuple[List[int], Iterable]]:
+        if effective_n_jobs(self.n_jobs) == 1:
+            yield from self._transform_batches(items)
+            return
+        start = 0
+        for results in self._map_chunk_results(items):
+            yield list(range(start, start + len(results))), results
+            start += len(results)
+
+    def _map_chunk_results(self, items: List) -> Iterator[Iterable]:
+        """
+        Yields results of _transform_chunk, one per chunk, in input order.
+        """
+        n_jobs = effective_n_jobs(self.n_jobs)
+        if n_jobs == 1:
+            if items:
+                yield self._transform_chunk(items)
+            return
+        chunks = [
+            items[start:start+self.chunk_size]
+            for start in range(0, len(items), self.chunk_size)
+        ]
+        if len(chunks) <= 1:
+            yield from map(self._transform_chunk, chunks)
+            return
+        pool = getattr(self, '_pool', None)
+        if pool is not None:
+            yield from pool.imap(_transform_chunk_in_worker, chunks)
+            return
+        # the estimator (with its filter bank) is sent to every worker
+        # once, on startup, instead of being pickled with each chunk
+        with Pool(
+                min(n_jobs, len(chunks)),
+                initializer=_init_worker,
+                initargs=(self,)
+        ) as pool:
+            yield from pool.imap(_transform_chunk_in_worker, chunks)
+
+
+_worker_estimator = None
+
+
+def _init_worker(estimator: ParallelMixin):
+    global _worker_estimator
+    _worker_estimator = estimator
+
+
+def _transform_chunk_in_worker(chunk: List) -> Iterable:
+    return _worker_estimator._transform_chunk(chunk)
+
+
+def effective_n_jobs(n_jobs: int = None) -> int:
+    """
+    Translates n_jobs parameter to the number of processes,
+    negative values count down from the number of CPUs (-1 = all CPUs).
+    """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(1, os.cpu_count() + 1 + n_jobs)
+    return n_jobs
+
+
 def optimal_clusters(n_samples: int) -> int:
     """
     Returns optimal number of clusters for the given number of samples
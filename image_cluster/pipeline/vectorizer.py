@@ -1,31 +1,59 @@
-from typing import Iterable, Tuple
+from typing import Iterable, Iterator, List, Tuple
+from collections import defaultdict
 from itertools import product
 
 from sklearn.base import BaseEstimator, TransformerMixin
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
-from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
-from image_cluster.types import ImageData
+from image_cluster.pipeline.utils import (
+    NoFitMixin,
+    ParallelMixin,
+    VerboseMixin,
+    effective_n_jobs
+)
+from image_cluster.types import BitMask, ImageData
+
+
+def popcount(codes: np.array) -> np.array:
+    """
+    Number of set bits of every non-negative int64 code,
+    counted in parallel within each code (SWAR bit tricks).
+    """
+    codes = np.asarray(codes).astype(np.uint64)
+    codes = codes - (codes >> np.uint64(1) & np.uint64(0x5555555555555555))
+    codes = (codes & np.uint64(0x3333333333333333)) \
+        + (codes >> np.uint64(2) & np.uint64(0x3333333333333333))
+    codes = codes + (codes >> np.uint64(4)) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (
+        codes * np.uint64(0x0101010101010101) >> np.uint64(56)
+    ).astype(np.int64)
 
 
 class BaseImageVectorizer(
         BaseEstimator,
         TransformerMixin,
         NoFitMixin,
+        ParallelMixin,
         VerboseMixin
 ):
     """
     Base class for transformations:
     [ImageData] -> np.array(n_samples, n_features).
+    Floating point features are computed with given dtype.
     """
     def __init__(
             self,
             filter_shape: Tuple[int, int] = (3, 3),
+            n_jobs: int = None,
+            dtype: type = np.float64,
             verbose: bool = False
     ):
         self.filter_shape = filter_shape
         self.filters = self._generate_filters(*filter_shape)
         self.n_filters = len(self.filters)
+        self.n_jobs = n_jobs
+        self.dtype = dtype
         self.verbose = verbose
 
     def _generate_filters(self, x: int, y: int) -> np.array:
@@ -38,73 +66,488 @@ class BaseImageVectorizer(
         ).astype(np.uint8)
 
     def transform(self, image_data: Iterable[ImageData]) -> np.array:
-        self.vectors_ = np.array([
-            self.vectorize(img)
-            for img in self._progress(image_data)
-        ])
+        self.vectors_ = np.array(self._map_items(list(image_data)))
         return self.vectors_
 
+    def _transform_chunk(self, image_data: List[ImageData]) -> List:
+        return [self.vectorize(img) for img in image_data]
+
     def vectorize(self, image_data: ImageData) -> ImageData:
         raise NotImplementedError()
 
+    def _window_codes(self, img: np.array) -> Tuple[np.array, np.array]:
+        """
+        Computes bit codes of all image chunks using shifted slices,
+        along with a mask of chunks that contain only 0 and 1 values
+        (chunks with other values don't match any filter).
+        """
+        height = max(0, img.shape[0] - self.filter_shape[0] + 1)
+        width = max(0, img.shape[1] - self.filter_shape[1] + 1)
+        codes = np.zeros((height, width), dtype=np.int64)
+        binary = np.ones((height, width), dtype=np.bool_)
+        for x, y in product(
+                range(self.filter_shape[0]),
+                range(self.filter_shape[1])
+        ):
+            shifted = img[x:x+height, y:y+width]
+            codes <<= 1
+            codes |= shifted == 1
+            binary &= (shifted == 0) | (shifted == 1)
+        return codes, binary
+
+    def _packed_window_codes(self, mask: BitMask) -> np.array:
+        """
+        Computes bit codes of all chunks of a bit-packed mask
+        (all of them binary) directly from packed rows: codes of row
+        segments are shifted out of 16-bit words of adjacent bytes,
+        then segments of consecutive rows are concatenated.
+        Filters wider than 9 pixels fall back to the unpacked mask.
+        """
+        x, y = self.filter_shape
+        if y > 9:
+            return self._window_codes(mask.unpack())[0]
+        height = max(0, mask.shape[0] - x + 1)
+        width = max(0, mask.shape[1] - y + 1)
+        bits = np.zeros(
+            (mask.shape[0], mask.bits.shape[1] + 1),
+            dtype=np.int64
+        )
+        bits[:, :-1] = mask.bits
+        words = bits[:, :-1] << 8 | bits[:, 1:]
+        columns = np.arange(width)
+        segments = words[:, columns // 8] >> (16 - y - columns % 8) \
+            & (1 << y) - 1
+        codes = np.zeros((height, width), dtype=np.int64)
+        for row in range(x):
+            codes <<= y
+            codes |= segments[row:row+height]
+        return codes
+
+    def _matching_codes(self, img) -> np.array:
+        """
+        Bit codes of all binary chunks of an image or a bit-packed mask.
+        """
+        if isinstance(img, BitMask):
+            return self._packed_window_codes(img).ravel()
+        codes, binary = self._window_codes(img)
+        return codes[binary]
+
 
 class FilterImageVectorizer(BaseImageVectorizer):
     """
     Features: number of identity matches
     between image chunks and vectorizer filters.
+
+    Each binary image chunk matches exactly one filter, so instead of
+    comparing chunks with all filters, chunks are encoded as integer
+    bit codes (in the order of _generate_filters) and counted.
     """
+    def _generate_filters(self, x: int, y: int) -> range:
+        """
+        Filters are identified by their bit codes, so the filter bank
+        is never materialized.
+        """
+        return range(2**(x*y))
+
     def vectorize(self, image_data):
-        img = image_data.image
-        vector = np.zeros(self.n_filters, dtype=np.uint8)
-        xrange = np.arange(img.shape[0] - self.filter_shape[0] + 1)
-        yrange = np.arange(img.shape[1] - self.filter_shape[1] + 1)
-        for x, y in product(xrange, yrange):
-            img_chunk = img[x:x+self.filter_shape[0], y:y+self.filter_shape[1]]
-            filter_matches = np.all(self.filters == img_chunk, axis=(1, 2))
-            vector += filter_matches.astype(np.uint8)
-        return vector
+        return np.bincount(
+            self._matching_codes(image_data.image),
+            minlength=self.n_filters
+        )
+
+
+class HashedFilterImageVectorizer(FilterImageVectorizer):
+    """
+    Features: number of identity matches between image chunks
+    and vectorizer filters, hashed into n_features buckets
+    (exact FilterImageVectorizer features if there are
+    at most n_features filters).
+
+    Approximation for filter shapes with too many filters to count,
+    memory and time depend only on image sizes and n_features.
+    Filters can have up to 63 cells. Features are integer counts.
+    """
+    def __init__(
+            self,
+            filter_shape: Tuple[int, int] = (3, 3),
+            n_features: int = 4096,
+            n_jobs: int = None,
+            verbose: bool = False
+    ):
+        if filter_shape[0] * filter_shape[1] > 63:
+            raise ValueError(f"Filter shape too large: {filter_shape}")
+        self.n_features = n_features
+        super().__init__(filter_shape, n_jobs, verbose=verbose)
+
+    def _generate_filters(self, x: int, y: int) -> range:
+        return range(min(2**(x*y), self.n_features))
+
+    def vectorize(self, image_data):
+        codes = self._matching_codes(image_data.image)
+        if self.n_filters < 2**(self.filter_shape[0]*self.filter_shape[1]):
+            # multiplicative (Fibonacci) hashing, wrapping on overflow
+            codes = (
+                codes.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+                >> np.uint64(32)
+            ) % np.uint64(self.n_filters)
+        return np.bincount(codes.astype(np.int64), minlength=self.n_filters)
 
 
 class IOUImageVectorizer(BaseImageVectorizer):
     """
     Features: sum of intersection-over-union metric values
     between image chunks and vectorizer filters.
+
+    All windows of a batch of same-shape images are extracted at once,
+    and intersections with the whole filter bank are computed
+    as a single matrix product (unions are just sum(filter) + sum(chunk)).
+
+    If there are more than max_filters possible filters (e.g. for
+    filter shapes larger than 3x3), features are computed only for
+    max_filters distinct filters sampled uniformly with random_state
+    (in the order of _generate_filters), which approximates
+    the full feature vector by a random subset of its coordinates.
+    Without max_filters, filter shapes with more than max_bank_size
+    filters are rejected.
     """
+    # upper bound for the number of (window, filter) IOU values
+    # kept in memory at once during vectorization
+    max_batch_elements = 2**23
+    # upper bound for the number of filters generated without max_filters
+    max_bank_size = 2**16
+
+    def __init__(
+            self,
+            filter_shape: Tuple[int, int] = (3, 3),
+            n_jobs: int = None,
+            dtype: type = np.float64,
+            verbose: bool = False,
+            max_filters: int = None,
+            random_state: int = 0
+    ):
+        self.max_filters = max_filters
+        self.random_state = random_state
+        super().__init__(filter_shape, n_jobs, dtype, verbose)
+
+    def _generate_filters(self, x: int, y: int) -> np.array:
+        n_bits = x * y
+        if self.max_filters is None and 2**n_bits > self.max_bank_size:
+            raise ValueError(
+                f"Filter shape {x}x{y} has 2^{n_bits} filters, more than "
+                f"{self.max_bank_size}, use max_filters to sample them"
+            )
+        if self.max_filters is None or 2**n_bits <= self.max_filters:
+            return super()._generate_filters(x, y)
+        rng = np.random.RandomState(self.random_state)
+        if n_bits > 62:
+            # duplicates are practically impossible
+            bits = rng.randint(0, 2, size=(self.max_filters, n_bits))
+        else:
+            codes = np.zeros(0, dtype=np.int64)
+            while len(codes) < self.max_filters:
+                codes = np.unique(np.concatenate([codes, rng.randint(
+                    0,
+                    2**n_bits,
+                    size=self.max_filters - len(codes),
+                    dtype=np.int64
+                )]))
+            bits = codes[:, np.newaxis] >> np.arange(n_bits)[::-1] & 1
+        return bits.reshape(-1, x, y).astype(np.uint8)
+
+    def _transform_chunk(self, image_data):
+        vectors = np.zeros((len(image_data), self.n_filters), dtype=self.dtype)
+        for batch, batch_vectors in self._transform_batches(image_data):
+            vectors[batch] = batch_vectors
+        return vectors
+
     def vectorize(self, image_data):
-        img = image_data.image
-        vector = np.zeros(self.n_filters, dtype=np.float)
-        xrange = np.arange(img.shape[0] - self.filter_shape[0] + 1)
-        yrange = np.arange(img.shape[1] - self.filter_shape[1] + 1)
-        for x, y in product(xrange, yrange):
-            img_chunk = img[x:x+self.filter_shape[0], y:y+self.filter_shape[1]]
+        if isinstance(image_data.image, BitMask):
+            return self.vectorize_packed(image_data.image)
+        return self.vectorize_batch(image_data.image[np.newaxis])[0]
+
+    def vectorize_batch(self, images: np.array) -> np.array:
+        """
+        Computes feature vectors for an array of same-shape images
+        (n_images, height, width) -> (n_images, n_filters).
+        """
+        windows = self._extract_windows(images)
+        filters = self.filters.reshape(self.n_filters, -1).astype(self.dtype)
+        filter_sizes = np.sum(filters, axis=1)
+        vectors = np.zeros((len(images), self.n_filters), dtype=self.dtype)
+        step = max(
+            1,
+            self.max_batch_elements // (max(1, len(images)) * self.n_filters)
+        )
+        for start in range(0, windows.shape[1], step):
+            chunks = windows[:, start:start+step]
             # using non-boolean sum and union for both binary masks
             # and (0,1) floating point range greyscale images
-            intersections = np.sum(self.filters * img_chunk, axis=(1, 2))
-            unions = np.sum(self.filters + img_chunk, axis=(1, 2))
+            intersections = chunks @ filters.T
+            unions = np.sum(chunks, axis=2)[:, :, np.newaxis] + filter_sizes
             # special case handling: 0/0 division => IOU = 1.
-            intersections[unions == 0] = 1
-            unions[unions == 0] = 1
-            filter_ious = intersections / unions
-            vector += filter_ious
+            empty = unions == 0
+            intersections[empty] = 1
+            unions[empty] = 1
+            vectors += np.sum(intersections / unions, axis=1)
+        return vectors
+
+    def vectorize_packed(self, mask: BitMask) -> np.array:
+        """
+        Computes feature vector of a bit-packed mask.
+        Binary chunks are fully described by their bit codes,
+        so IOU values are computed once per chunk code (for all codes
+        if the table fits max_batch_elements, otherwise for distinct
+        codes of the mask) and weighted by the number of such chunks.
+        """
+        x, y = self.filter_shape
+        if x * y > 62:
+            return self.vectorize_batch(mask.unpack()[np.newaxis])[0]
+        codes = self._packed_window_codes(mask).ravel()
+        if getattr(self, 'filter_codes_', None) is None:
+            self.filter_codes_ = np.sum(
+                self.filters.reshape(self.n_filters, -1).astype(np.int64)
+                << np.arange(x*y)[::-1],
+                axis=1
+            )
+        if 2**(x*y) * self.n_filters <= self.max_batch_elements:
+            if getattr(self, 'iou_table_', None) is None:
+                self.iou_table_ = self._code_iou(np.arange(2**(x*y)))
+            counts = np.bincount(codes, minlength=2**(x*y))
+            return counts.astype(self.dtype) @ self.iou_table_
+        codes, counts = np.unique(codes, return_counts=True)
+        vector = np.zeros(self.n_filters, dtype=self.dtype)
+        step = max(1, self.max_batch_elements // self.n_filters)
+        for start in range(0, len(codes), step):
+            vector += counts[start:start+step].astype(self.dtype) \
+                @ self._code_iou(codes[start:start+step])
         return vector
 
+    def _code_iou(self, codes: np.array) -> np.array:
+        """
+        IOU values (as in vectorize_batch) between binary chunks
+        with given bit codes and all filters, (n_codes, n_filters):
+        intersections are popcounts of bitwise AND of chunk and filter
+        codes (filter_codes_, set by vectorize_packed),
+        unions are sums of their popcounts.
+        """
+        filter_codes = self.filter_codes_
+        intersections = popcount(codes[:, np.newaxis] & filter_codes)
+        unions = popcount(codes)[:, np.newaxis] + popcount(filter_codes)
+        # special case handling: 0/0 division => IOU = 1.
+        empty = unions == 0
+        intersections[empty] = 1
+        unions[empty] = 1
+        return (intersections / unions).astype(self.dtype)
+
+    def _transform_batches(
+            self,
+            image_data: List[ImageData]
+    ) -> Iterator[Tuple[List[int], np.array]]:
+        """
+        Yields indices of batches of images with their vectors,
+        vectorizing images of the same shape together in batches
+        bounded by max_batch_elements.
+        """
+        for batch, images in self._image_batches(image_data):
+            if isinstance(images, BitMask):
+                yield batch, self.vectorize_packed(images)[np.newaxis]
+            else:
+                yield batch, self.vectorize_batch(images)
+
+    def _image_batches(
+            self,
+            image_data: List[ImageData]
+    ) -> Iterator[Tuple[List[int], np.array]]:
+        """
+        Groups images by shape, yields batches of their indices
+        together with stacked images (n_images, height, width).
+        Bit-packed masks are yielded one by one, as BitMask.
+        """
+        groups = defaultdict(list)
+        for idx, img in enumerate(image_data):
+            if isinstance(img.image, BitMask):
+                yield [idx], img.image
+            else:
+                groups[img.image.shape].append(idx)
+        for (height, width), indices in groups.items():
+            n_windows = (
+                max(0, height - self.filter_shape[0] + 1)
+                * max(0, width - self.filter_shape[1] + 1)
+            )
+            batch_size = max(
+                1,
+                self.max_batch_elements // max(1, n_windows * self.n_filters)
+            )
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start+batch_size]
+                yield batch, np.stack([image_data[idx].image for idx in batch])
+
+    def _extract_windows(self, images: np.array) -> np.array:
+        """
+        Extracts all filter-shaped windows from an array of images,
+        (n_images, height, width) -> (n_images, n_windows, filter_size).
+        """
+        n_images, height, width = images.shape
+        x, y = self.filter_shape
+        windows = as_strided(
+            images,
+            shape=(
+                n_images,
+                max(0, height - x + 1),
+                max(0, width - y + 1),
+                x,
+                y
+            ),
+            strides=images.strides + images.strides[1:],
+            writeable=False
+        )
+        return windows.reshape(n_images, -1, x*y).astype(self.dtype)
+
+
+class FusedImageVectorizer(IOUImageVectorizer):
+    """
+    Features: IOU vectors, image shape and text density (in the order
+    given by features), computed in a single pass over batches of images,
+    equivalent to FeatureUnion of IOUImageVectorizer, ShapeVectorizer
+    and TextDensityVectorizer. Rows are written into preallocated matrix
+    (directly with a single job, by chunks with n_jobs processes).
+    """
+    feature_sizes = {'iou': None, 'shape': 2, 'density': 1}
+
+    def __init__(
+            self,
+            filter_shape: Tuple[int, int] = (3, 3),
+            features: Tuple[str, ...] = ('iou', 'shape', 'density'),
+            n_jobs: int = None,
+            dtype: type = np.float64,
+            verbose: bool = False,
+            max_filters: int = None,
+            random_state: int = 0
+    ):
+        if not features:
+            raise ValueError("At least one feature is required")
+        unknown = [name for name in features if name not in self.feature_sizes]
+        if unknown:
+            raise ValueError(
+                f"Unknown features: {unknown}, "
+                f"expected some of {list(self.feature_sizes)}"
+            )
+        super().__init__(
+            filter_shape,
+            n_jobs,
+            dtype,
+            verbose,
+            max_filters,
+            random_state
+        )
+        self.features = features
+
+    def transform(self, image_data: Iterable[ImageData]) -> np.array:
+        image_data = list(image_data)
+        self.vectors_ = self._empty_vectors(len(image_data))
+        if effective_n_jobs(self.n_jobs) == 1:
+            for _ in self._progress_chunks(
+                    self._fill(image_data, self.vectors_),
+                    total=len(image_data)
+            ):
+                pass
+            return self.vectors_
+        start = 0
+        for vectors in self._progress_chunks(
+                self._map_chunk_results(image_data),
+                total=len(image_data)
+        ):
+            self.vectors_[start:start+len(vectors)] = vectors
+            start += len(vectors)
+        return self.vectors_
+
+    def vectorize(self, image_data):
+        return self._transform_chunk([image_data])[0]
+
+    def _transform_chunk(self, image_data):
+        vectors = self._empty_vectors(len(image_data))
+        for _ in self._fill(image_data, vectors):
+            pass
+        return vectors
+
+    def _empty_vectors(self, n_images: int) -> np.array:
+        return np.empty(
+            (n_images, self._feature_columns()[-1][1].stop),
+            dtype=self.dtype
+        )
+
+    def _fill(
+            self,
+            image_data: List[ImageData],
+            vectors: np.array
+    ) -> Iterator[List[int]]:
+        """
+        Writes feature rows of images into vectors,
+        yields indices of images in every written batch.
+        """
+        columns = self._feature_columns()
+        for batch, images in self._image_batches(image_data):
+            if isinstance(images, BitMask):
+                self._fill_packed(vectors[batch[0]], columns, images)
+                yield batch
+                continue
+            for feature, column in columns:
+                if feature == 'iou':
+                    vectors[batch, column] = self.vectorize_batch(images)
+                elif feature == 'shape':
+                    vectors[batch, column] = images.shape[1:]
+                else:
+                    vectors[batch, column] = np.sum(
+                        images,
+                        axis=(1, 2)
+                    )[:, np.newaxis] / (images.shape[1] * images.shape[2])
+            yield batch
+
+    def _fill_packed(
+            self,
+            vector: np.array,
+            columns: List[Tuple[str, slice]],
+            mask: BitMask
+    ):
+        for feature, column in columns:
+            if feature == 'iou':
+                vector[column] = self.vectorize_packed(mask)
+            elif feature == 'shape':
+                vector[column] = mask.shape
+            else:
+                vector[column] = mask.count() / (mask.shape[0] * mask.shape[1])
+
+    def _feature_columns(self) -> List[Tuple[str, slice]]:
+        columns = []
+        start = 0
+        for feature in self.features:
+            size = self.feature_sizes[feature] or self.n_filters
+            columns.append((feature, slice(start, start + size)))
+            start += size
+        return columns
+
 
 class BaseFeatureGenerator(
         BaseEstimator,
         TransformerMixin,
         NoFitMixin,
+        ParallelMixin,
         VerboseMixin
 ):
-    def __init__(self, verbose: bool = False):
+    def __init__(self, n_jobs: int = None, verbose: bool = False):
+        self.n_jobs = n_jobs
         self.verbose = verbose
 
     def transform(self, image_data: Iterable[ImageData]):
-        self.features_ = np.array([
-            self.compute_feature(img)
-            for img in self._progress(image_data)
-        ]).reshape(len(image_data), -1)
+        image_data = list(image_data)
+        self.features_ = np.array(
+            self._map_items(image_data)
+        ).reshape(len(image_data), -1)
         return self.features_
 
+    def _transform_chunk(self, image_data: List[ImageData]) -> List:
+        return [self.compute_feature(img) for img in image_data]
+
     def compute_feature(self, image_data: ImageData) -> ImageData:
         raise NotImplementedError()
 
@@ -1,9 +1,18 @@
+from contextlib import nullcontext
+from html import escape
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Iterable
+from typing import Dict, Iterable, List, Tuple
 
 from sklearn.base import BaseEstimator, TransformerMixin
+import cv2 as cv
+import numpy as np
 
-from image_cluster.pipeline.utils import NoFitMixin, VerboseMixin
+from image_cluster.pipeline.utils import (
+    NoFitMixin,
+    VerboseMixin,
+    effective_n_jobs
+)
 from image_cluster.types import ClusterData
 
 
@@ -11,9 +20,18 @@ class Writer(BaseEstimator, TransformerMixin, VerboseMixin, NoFitMixin):
     """
     Composite class in composite pattern of writers.
     """
-    def __init__(self, output_dir: Path, html: bool, verbose: bool = False):
+    def __init__(
+            self,
+            output_dir: Path,
+            html: bool,
+            verbose: bool = False,
+            report: bool = False,
+            n_jobs: int = None
+    ):
         output_dir = output_dir.resolve()
         output_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir = output_dir
+        self.verbose = verbose
         self.writers = [TxtWriter(
             output_dir / 'clusters.txt',
             verbose=verbose
@@ -23,11 +41,36 @@ class Writer(BaseEstimator, TransformerMixin, VerboseMixin, NoFitMixin):
                 output_dir / 'clusters.html',
                 verbose=verbose
             ))
+        if report:
+            self.writers.append(ReportWriter(
+                output_dir / 'report',
+                n_jobs=n_jobs,
+                verbose=verbose
+            ))
 
     def transform(self, clusters: Iterable[ClusterData]):
         for writer in self.writers:
             writer.transform(clusters)
 
+    def append(self, clusters: Iterable[ClusterData], cluster_ids: List):
+        """
+        Appends images to clusters in existing output files,
+        cluster_ids list the order of clusters in these files.
+        Writers of files missing from the output are skipped,
+        the paginated report is not updated.
+        """
+        positions = {idx: pos for pos, idx in enumerate(cluster_ids)}
+        new_images = {
+            positions[cluster.idx]: cluster for cluster in clusters
+        }
+        for writer in self.writers:
+            if writer.output_file.exists():
+                writer.append(new_images)
+            else:
+                self._log(f"{writer.output_file.name} not found, skipping")
+        if (self.output_dir / 'report').exists():
+            self._log("report/ is not updated with appended images")
+
 
 class TxtWriter(VerboseMixin):
     """
@@ -44,10 +87,18 @@ class TxtWriter(VerboseMixin):
 
     def transform(self, clusters: Iterable[ClusterData]):
         with open(self.output_file, 'w') as f:
-            f.writelines([
-                self._format(cluster) + "\n"
-                for cluster in self._progress(clusters)
-            ])
+            for cluster in self._progress(clusters):
+                f.write(self._format(cluster) + "\n")
+
+    def append(self, new_images: Dict[int, ClusterData]):
+        with open(self.output_file, 'r') as f:
+            lines = f.read().splitlines()
+        for pos, cluster in new_images.items():
+            lines[pos] = " ".join(
+                filter(None, [lines[pos], self._format(cluster)])
+            )
+        with open(self.output_file, 'w') as f:
+            f.writelines([line + "\n" for line in lines])
 
 
 class HtmlWriter(VerboseMixin):
@@ -67,8 +118,154 @@ class HtmlWriter(VerboseMixin):
 
     def transform(self, clusters: Iterable[ClusterData]):
         with open(self.output_file, 'w') as f:
-            f.write("<hr>\n".join([
+            for idx, cluster in enumerate(self._progress(clusters)):
+                if idx > 0:
+                    f.write("<hr>\n")
+                f.write(self._format(cluster))
+            f.write("\n")
+
+    def append(self, new_images: Dict[int, ClusterData]):
+        with open(self.output_file, 'r') as f:
+            sections = f.read()[:-1].split("<hr>\n")
+        for pos, cluster in new_images.items():
+            sections[pos] = " ".join(filter(None, [
+                sections[pos].rstrip("\n"),
                 self._format(cluster)
-                for cluster in self._progress(clusters)
             ]))
+        with open(self.output_file, 'w') as f:
+            f.write("<hr>\n".join(sections))
             f.write("\n")
+
+
+class ReportWriter(VerboseMixin):
+    """
+    Child writer component, saves cluster data as a paginated html report:
+    index page and one page per cluster, showing thumbnails packed into
+    sprite sheets. Sprite sheets are rendered by a pool of n_jobs
+    processes while pages are written, one line at a time
+    (inline with a single job).
+    """
+    def __init__(
+            self,
+            output_dir: Path,
+            thumbnail_size: int = 32,
+            sheet_columns: int = 32,
+            sheet_rows: int = 32,
+            n_jobs: int = None,
+            verbose: bool = False
+    ):
+        self.output_dir = output_dir
+        self.thumbnail_size = thumbnail_size
+        self.sheet_columns = sheet_columns
+        self.sheet_rows = sheet_rows
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+
+    def transform(self, clusters: Iterable[ClusterData]):
+        (self.output_dir / 'sprites').mkdir(parents=True, exist_ok=True)
+        n_jobs = effective_n_jobs(self.n_jobs)
+        pool = nullcontext() if n_jobs == 1 else Pool(n_jobs)
+        with pool, open(self.output_dir / 'index.html', 'w') as index:
+            index.write(
+                "<html><head><title>Clusters</title></head><body>\n"
+                "<h1>Clusters</h1>\n<ul>\n"
+            )
+            sheets = []
+            for cluster in self._progress(clusters):
+                images = [
+                    (str(img.name), str(img.path)) for img in cluster.images
+                ]
+                tasks = self._sheet_tasks(cluster.idx, images)
+                if n_jobs == 1:
+                    for task in tasks:
+                        _render_sheet(task)
+                else:
+                    sheets.append(pool.map_async(
+                        _render_sheet,
+                        tasks,
+                        chunksize=1
+                    ))
+                page = self._write_page(cluster.idx, images)
+                index.write(
+                    f'<li><a href="{page}">Cluster {cluster.idx}</a> '
+                    f'({len(images)} images)</li>\n'
+                )
+            index.write("</ul>\n</body></html>\n")
+            for result in sheets:
+                result.get()
+
+    def _sheet_tasks(
+            self,
+            cluster_idx: int,
+            images: List[Tuple[str, str]]
+    ) -> List[Tuple]:
+        per_sheet = self.sheet_columns * self.sheet_rows
+        return [
+            (
+                [path for _, path in images[start:start+per_sheet]],
+                str(self.output_dir / self._sheet_name(cluster_idx, start)),
+                self.thumbnail_size,
+                self.sheet_columns
+            )
+            for start in range(0, len(images), per_sheet)
+        ]
+
+    def _sheet_name(self, cluster_idx: int, start: int) -> str:
+        per_sheet = self.sheet_columns * self.sheet_rows
+        return f"sprites/cluster_{cluster_idx}_{start // per_sheet}.png"
+
+    def _write_page(
+            self,
+            cluster_idx: int,
+            images: List[Tuple[str, str]]
+    ) -> str:
+        size = self.thumbnail_size
+        per_sheet = self.sheet_columns * self.sheet_rows
+        page = f"cluster_{cluster_idx}.html"
+        with open(self.output_dir / page, 'w') as f:
+            f.write(
+                f"<html><head><title>Cluster {cluster_idx}</title><style>"
+                f"a.t{{display:inline-block;width:{size}px;height:{size}px;"
+                f"margin:1px}}</style></head><body>\n"
+                f'<a href="index.html">index</a>\n'
+                f"<h1>Cluster {cluster_idx} ({len(images)} images)</h1>\n"
+            )
+            for pos, (name, path) in enumerate(images):
+                cell = pos % per_sheet
+                x = cell % self.sheet_columns * size
+                y = cell // self.sheet_columns * size
+                sheet = self._sheet_name(cluster_idx, pos - cell)
+                f.write(
+                    f'<a class="t" href="file://{escape(path)}" '
+                    f'title="{escape(name)}" style="background:'
+                    f'url({sheet}) -{x}px -{y}px"></a>\n'
+                )
+            f.write("</body></html>\n")
+        return page
+
+
+def _render_sheet(task: Tuple[List[str], str, int, int]):
+    """
+    Renders downscaled images into a single sprite sheet (grid of cells).
+    """
+    paths, sheet_path, size, columns = task
+    rows = (len(paths) + columns - 1) // columns
+    sheet = np.full(
+        (rows * size, min(len(paths), columns) * size),
+        255,
+        dtype=np.uint8
+    )
+    for pos, path in enumerate(paths):
+        img = cv.imread(path, cv.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        scale = size / max(img.shape)
+        height = max(1, int(round(img.shape[0] * scale)))
+        width = max(1, int(round(img.shape[1] * scale)))
+        thumbnail = cv.resize(
+            img, (width, height), interpolation=cv.INTER_AREA
+        )
+        y = pos // columns * size
+        x = pos % columns * size
+        sheet[y:y+height, x:x+width] = thumbnail
+    cv.imwrite(sheet_path, sheet)
@@ -0,0 +1,238 @@
+from collections import deque
+from concurrent.futures import Future
+from contextlib import ExitStack
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from socketserver import ThreadingMixIn, UnixStreamServer
+from threading import Lock, Thread
+from typing import Dict, List
+import json
+import os
+import time
+
+import numpy as np
+
+from image_cluster.pipeline.assigner import Assigner
+from image_cluster.pipeline.reader import ImageReadError
+from image_cluster.pipeline.utils import ParallelMixin
+
+
+class BatchingAssigner(object):
+    """
+    Assigns images to clusters in a background thread, grouping
+    concurrent requests into batches of up to max_batch_size images
+    (waiting at most max_wait seconds for more requests),
+    so that every batch is vectorized and assigned in a single call.
+    Parallel preprocessing steps keep their worker processes
+    until close is called. Keeps throughput and latency counters.
+    """
+    def __init__(
+            self,
+            assigner: Assigner,
+            max_batch_size: int = 256,
+            max_wait: float = 0.005,
+            n_latencies: int = 10000
+    ):
+        self.assigner = assigner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = Queue()
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.counters = dict(
+            requests=0,
+            images=0,
+            batches=0,
+            errors=0,
+            busy_seconds=0.
+        )
+        # latencies of the most recent requests, in seconds
+        self.latencies = deque(maxlen=n_latencies)
+        # worker processes are started before the worker thread,
+        # so that they are not forked while it is running
+        self.pools = ExitStack()
+        params = assigner.preprocessing.get_params(deep=True)
+        for estimator in params.values():
+            if isinstance(estimator, ParallelMixin):
+                self.pools.enter_context(estimator.worker_pool())
+        self.worker = Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def close(self):
+        """
+        Stops worker processes of preprocessing steps.
+        """
+        self.pools.close()
+
+    def assign(self, paths: List[str]) -> Dict[str, list]:
+        """
+        Blocks until images are assigned, returns their cluster ids,
+        distances to centroids and outlier flags.
+        Raises ImageReadError if any image can't be read.
+        """
+        future = Future()
+        self.queue.put((time.monotonic(), list(paths), future))
+        return future.result()
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            counters = dict(self.counters)
+            latencies = np.array(self.latencies) * 1000
+        uptime = time.monotonic() - self.started
+        counters.update(
+            uptime_seconds=uptime,
+            images_per_second=counters['images'] / max(uptime, 1e-9),
+            mean_batch_size=counters['images'] / max(1, counters['batches'])
+        )
+        for name, percentile in (('p50', 50), ('p95', 95), ('p99', 99)):
+            counters[f'latency_{name}_ms'] = float(
+                np.percentile(latencies, percentile)
+            ) if len(latencies) else 0.
+        counters['latency_max_ms'] = float(
+            np.max(latencies)
+        ) if len(latencies) else 0.
+        return counters
+
+    def _work(self):
+        while True:
+            requests = [self.queue.get()]
+            n_images = len(requests[0][1])
+            deadline = time.monotonic() + self.max_wait
+            while n_images < self.max_batch_size:
+                try:
+                    request = self.queue.get(
+                        timeout=max(0, deadline - time.monotonic())
+                    )
+                except Empty:
+                    break
+                requests.append(request)
+                n_images += len(request[1])
+            start = time.monotonic()
+            try:
+                results = self._assign_batch([
+                    paths for _, paths, _ in requests
+                ])
+            except ImageReadError:
+                # assign requests one by one, so that only failed ones fail
+                results = []
+                for _, paths, _ in requests:
+                    try:
+                        results.append(self._assign_batch([paths])[0])
+                    except ImageReadError as error:
+                        results.append(error)
+            except Exception as error:
+                results = [error] * len(requests)
+            end = time.monotonic()
+            with self.lock:
+                self.counters['batches'] += 1
+                self.counters['busy_seconds'] += end - start
+                for (received, paths, _), result in zip(requests, results):
+                    self.counters['requests'] += 1
+                    if isinstance(result, Exception):
+                        self.counters['errors'] += 1
+                    else:
+                        self.counters['images'] += len(paths)
+                    self.latencies.append(end - received)
+            for (_, _, future), result in zip(requests, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _assign_batch(self, batch: List[List[str]]) -> List[Dict[str, list]]:
+        # metadata reader is the first step of preprocessing
+        metadata_reader = self.assigner.preprocessing.steps[0][1]
+        image_data = [
+            metadata_reader.parse_meta_line(path)
+            for paths in batch for path in paths
+        ]
+        labels, distances = self.assigner.predict_images(image_data)
+        outliers = self.assigner.outliers(labels, distances)
+        results = []
+        start = 0
+        for paths in batch:
+            rows = slice(start, start + len(paths))
+            results.append(dict(
+                clusters=labels[rows].tolist(),
+                distances=distances[rows].tolist(),
+                outliers=outliers[rows].tolist()
+            ))
+            start += len(paths)
+        return results
+
+
+class AssignHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of BatchingAssigner (server.batching_assigner):
+    POST /assign with JSON {"paths": [...]} assigns images,
+    GET /stats returns counters.
+    """
+    # connections are kept alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        content = self.rfile.read(length)
+        if self.path != '/assign':
+            return self._respond(404, dict(error="not found"))
+        try:
+            paths = json.loads(content)['paths']
+        except (ValueError, KeyError, TypeError):
+            return self._respond(400, dict(error="expected {\"paths\": []}"))
+        try:
+            result = self.server.batching_assigner.assign(paths)
+        except ImageReadError as error:
+            return self._respond(400, dict(error=str(error)))
+        except Exception as error:
+            return self._respond(500, dict(error=repr(error)))
+        self._respond(200, result)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._respond(404, dict(error="not found"))
+        self._respond(200, self.server.batching_assigner.stats())
+
+    def _respond(self, status: int, body: dict):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        # unix socket clients have no address
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(
+        batching_assigner: BatchingAssigner,
+        host: str = '127.0.0.1',
+        port: int = 8080,
+        socket_path: str = None,
+        verbose: bool = False
+):
+    """
+    Creates HTTP server listening on localhost port,
+    or on a Unix socket if socket_path is given.
+    """
+    if socket_path is None:
+        server = ThreadingHTTPServer((host, port), AssignHandler)
+        server.daemon_threads = True
+    else:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, AssignHandler)
+    server.batching_assigner = batching_assigner
+    server.verbose = verbose
+    return server
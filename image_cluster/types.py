@@ -1,9 +1,8 @@
 from dataclasses import dataclass, asdict, field
 from pathlib import Path
-from typing import Tuple, List
+from typing import Tuple, List, Union
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 Image = np.array
@@ -18,22 +17,91 @@ class ImageData(object):
     cluster: int = None
 
     def show(self):
-        printable_image = ((1 - self.image) * 255).astype(np.unit8)
+        import matplotlib.pyplot as plt
+        image = self.image
+        if image is None:
+            # pixels are released in low-memory mode, reload them on demand
+            import cv2 as cv
+            image = 1 - cv.imread(str(self.path), cv.IMREAD_GRAYSCALE) / 255
+        printable_image = ((1 - np.asarray(image)) * 255).astype(np.uint8)
         plt.title(f"Image {self.name} in cluster {self.cluster}")
         plt.imshow(printable_image)
         plt.show()
 
 
+@dataclass(eq=False)
+class BitMask(object):
+    """
+    Binary image (0 = white, 1 = black) with rows packed into bits
+    (np.packbits), taking 8 times less memory than an uint8 mask.
+    Converts to uint8 mask when used as numpy array.
+    """
+    bits: np.array
+    shape: ImageShape
+
+    @classmethod
+    def from_mask(cls, mask: Image):
+        return cls(np.packbits(mask.astype(np.bool_), axis=1), mask.shape)
+
+    def unpack(self) -> Image:
+        return np.unpackbits(self.bits, axis=1)[:, :self.shape[1]]
+
+    def count(self) -> int:
+        """
+        Number of black pixels (padding bits are always 0).
+        """
+        return int(np.sum(np.unpackbits(self.bits)))
+
+    def __array__(self, dtype=None):
+        return self.unpack().astype(dtype or np.uint8)
+
+
+@dataclass
+class ImageTable(object):
+    """
+    Compact, array-backed list of images (without pixel data).
+    Indexing with an integer creates ImageData record on demand,
+    indexing with a slice or index array returns another ImageTable.
+    """
+    names: np.array
+    paths: np.array
+    clusters: np.array
+
+    @classmethod
+    def from_images(cls, images: List[ImageData], clusters: np.array):
+        return cls(
+            np.array([img.name for img in images]),
+            np.array([str(img.path) for img in images]),
+            np.asarray(clusters)
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return ImageData(
+                self.names[idx],
+                Path(self.paths[idx]),
+                cluster=self.clusters[idx]
+            )
+        return ImageTable(self.names[idx], self.paths[idx], self.clusters[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
 @dataclass
 class ClusterData(object):
     idx: int
-    images: List[ImageData] = field(default_factory=list)
+    images: Union[List[ImageData], ImageTable] = field(default_factory=list)
 
     def show(self, n_samples: int = -1):
         if n_samples == -1:
             last_sample = len(self.images)
         else:
-            last_sample = min(len(self.images, n_samples))
+            last_sample = min(len(self.images), n_samples)
         for img in self.images[:last_sample]:
             img.show()
 
@@ -49,6 +117,9 @@ class Score(object):
     label_size_max: int
     label_size_mean: float
     label_size_var: float
+    silhouette_method: str = 'exact'
+    silhouette_ci_low: float = None
+    silhouette_ci_high: float = None
 
     def __str__(self):
         title = f"{self.__class__.__name__}:"
@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name="ImageCluster",
     version="0.1",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     author="Krzysztof Kowalczyk",
     author_email="kk385830@students.mimuw.edu.pl",
     license="BSD 2-Clause"